@@ -0,0 +1,183 @@
+"""
+Throughput benchmarks for httpagentparser.
+
+    python benchmark.py            # run every benchmark
+    python benchmark.py sketches   # run the named benchmarks only
+    python benchmark.py --corpus big.txt exact   # over a corpus file, see corpus.py
+"""
+import random
+import sys
+import time
+
+import httpagentparser
+from tests import data
+
+
+def load_corpus(path=None):
+    """
+    path: file of agents, one per line; tests.py data and useragent.txt by default
+    """
+    if path is not None:
+        with open(path, encoding='utf-8', errors='replace') as f:
+            return [line.rstrip('\n') for line in f]
+    agents = [agent for agent, _, _ in data]
+    with open('useragent.txt') as f:
+        agents.extend(line.strip() for line in f if len(line.strip()) > 5)
+    return agents
+
+
+def measure(label, func, items):
+    then = time.time()
+    for item in items:
+        func(item)
+    taken = time.time() - then
+    print("%-40s %8d calls %8.3fs %10.0f/s" % (label, len(items), taken, len(items) / taken if taken else 0))
+    return taken
+
+
+def bench_sketches(agents):
+    from httpagentparser.sketches import UAStreamStats
+
+    rnd = random.Random(0)
+    stream = [rnd.choice(agents) for _ in range(20000)]
+    results = dict((agent, httpagentparser.detect(agent)) for agent in set(stream))
+
+    measure('detect', httpagentparser.detect, stream)
+    stats = UAStreamStats()
+    measure('sketches only (pre-parsed)', lambda a: stats.add(a, results[a]), stream)
+    stats = UAStreamStats()
+    measure('detect + sketches', stats.add, stream)
+    print('distinct agents: %s (exact %s)' % (stats.distinct_agents.count(), len(results)))
+
+
+def bench_pathological(agents):
+    from tests import pathological_agents
+
+    for size in (4096, 65536):
+        for name, agent in sorted(pathological_agents(size).items()):
+            measure('%s %dKB unlimited' % (name, size // 1024),
+                    lambda a: httpagentparser.detect(a, max_length=0), [agent] * 20)
+            measure('%s %dKB default limit' % (name, size // 1024), httpagentparser.detect, [agent] * 20)
+
+
+def count_extractions(engine, agents):
+    """
+    => number of version and model extractions made by detect() over agents
+    """
+    calls = [0]
+
+    def counting(method):
+        def wrapper(*args):
+            calls[0] += 1
+            return method(*args)
+        return wrapper
+
+    detectors = httpagentparser.detectorshub.detectors()
+    for detector in detectors:
+        detector.versionFor = counting(detector.versionFor)
+        detector.modelAt = counting(detector.modelAt)
+    try:
+        for agent in agents:
+            httpagentparser.detect(agent, engine=engine)
+    finally:
+        for detector in detectors:
+            del detector.versionFor, detector.modelAt
+    return calls[0]
+
+
+def bench_engines(agents):
+    for engine in httpagentparser.ENGINES:
+        measure('engine %s' % engine, lambda a: httpagentparser.detect(a, engine=engine), agents * 50)
+        print('%-40s %8d version/model extractions' % ('', count_extractions(engine, agents)))
+
+
+def bench_scan(agents):
+    import os
+    import tempfile
+    from httpagentparser.scan import count_file
+
+    rnd = random.Random(0)
+    fd, path = tempfile.mkstemp(suffix='.log')
+    try:
+        with os.fdopen(fd, 'w') as f:
+            for _ in range(200000):
+                f.write(rnd.choice(agents) + '\n')
+        lines = 200000
+        for workers in (1, os.cpu_count()):
+            then = time.time()
+            count_file(path, workers=workers, chunk_size=1024 * 1024)
+            taken = time.time() - then
+            print("%-40s %8d lines %8.3fs %10.0f/s" % ('count_file workers=%s' % workers, lines, taken, lines / taken))
+    finally:
+        os.remove(path)
+
+
+def bench_dispatch(agents):
+    clients = ['curl/7.68.0', 'python-requests/2.31.0', 'axios/1.6.0', 'Java/17.0.2', 'Netflix/6.0 DEVTYPE=LGTV;',
+               'Roku/DVP-9.10 (519.10E04111A)', 'Python-urllib/3.11']
+    hub = httpagentparser.detectorshub
+    for label, items in (('API clients', clients * 2000), ('corpus', agents * 50)):
+        for hub.dispatch, hub.prefilter in ((True, True), (False, True), (True, False), (False, False)):
+            measure('%s dispatch=%d prefilter=%d' % (label, hub.dispatch, hub.prefilter), httpagentparser.detect, items)
+    hub.dispatch = hub.prefilter = True
+
+
+def bench_junk(agents):
+    rnd = random.Random(0)
+    junk = [''.join(rnd.choice('abcdefghijklmnop0123456789 /;()') for _ in range(rnd.choice([30, 300, 3000])))
+            for _ in range(300)]
+    hub = httpagentparser.detectorshub
+    measure('junk, no negative cache', httpagentparser.detect, junk * 10)
+    hub.enable_negative_cache()
+    measure('junk, negative cache', httpagentparser.detect, junk * 10)
+    hub.negative_cache = None
+
+
+def bench_exact(agents):
+    hub = httpagentparser.detectorshub
+    measure('corpus, no exact table', httpagentparser.detect, agents * 3)
+    hub.exact_table = dict((agent, httpagentparser.freeze_result(result))
+                           for agent, result in hub.build_exact_table(agents, size=len(agents)).items())
+    measure('corpus, exact table', httpagentparser.detect, agents * 3)
+    measure('corpus, exact table, frozen', lambda agent: httpagentparser.detect(agent, frozen=True), agents * 3)
+    hub.exact_table = None
+
+
+def bench_profile(agents):
+    # the dispatch residual words are searched on the default path, skip_if_found
+    # order only matters to detectors that are not prefiltered out
+    hub = httpagentparser.detectorshub
+    profile = hub.profile_tokens(agents)
+    measure('default, declared order', httpagentparser.detect, agents * 10)
+    hub.apply_token_profile(profile)
+    measure('default, profiled order', httpagentparser.detect, agents * 10)
+    hub.apply_token_profile(None)
+    hub.prefilter = hub.dispatch = False
+    measure('no prefilter, declared order', httpagentparser.detect, agents * 10)
+    hub.apply_token_profile(profile)
+    measure('no prefilter, profiled order', httpagentparser.detect, agents * 10)
+    hub.apply_token_profile(None)
+    hub.dispatch = hub.prefilter = True
+
+
+BENCHMARKS = dict(
+    dispatch=bench_dispatch,
+    engines=bench_engines,
+    exact=bench_exact,
+    junk=bench_junk,
+    pathological=bench_pathological,
+    profile=bench_profile,
+    scan=bench_scan,
+    sketches=bench_sketches,
+)
+
+
+if __name__ == '__main__':
+    names = sys.argv[1:]
+    path = None
+    if names[:1] == ['--corpus']:
+        path, names = names[1], names[2:]
+    agents = load_corpus(path)
+    for name in names or sorted(BENCHMARKS):
+        print('== %s' % name)
+        BENCHMARKS[name](agents)
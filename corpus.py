@@ -0,0 +1,239 @@
+"""
+Synthetic User-Agent corpora for benchmarks.
+
+Agents are composed from the platforms and clients the detectors cover
+(Windows, macOS, iOS, Android, Linux, ChromeOS x Chrome, Safari, Firefox,
+Edge, Opera, plus bots, TV/console clients and API clients). A pool of
+distinct agents is drawn first; lines then repeat them with Zipf distributed
+frequencies, so the most common agent is about 2**s times as frequent as
+the second. A share of the lines is junk: random bytes, truncated agents
+and long token soups. The same arguments and seed always give the same
+corpus.
+
+    python corpus.py big.txt --lines 1000000 --distinct 50000 --junk 0.01
+    python benchmark.py --corpus big.txt exact dispatch
+"""
+import argparse
+import bisect
+import random
+
+CHROME = dict((major, '%d.0.%d.%d' % (major, 4400 + 60 * (major - 90), 50 + major % 7 * 20))
+              for major in range(100, 131))
+
+
+def _windows(rnd):
+    nt = rnd.choice(['10.0'] * 8 + ['6.1', '6.3'])
+    return '(Windows NT %s; %s)' % (nt, rnd.choice(['Win64; x64'] * 4 + ['WOW64']))
+
+
+def _mac(rnd):
+    # browsers freeze macOS at 10_15_7, older releases still send their own
+    return '(Macintosh; Intel Mac OS X %s)' % rnd.choice(['10_15_7'] * 6 + ['10_14_6', '10_13_6', '11_7_10'])
+
+
+def _linux(rnd):
+    return rnd.choice(['(X11; Linux x86_64)', '(X11; Ubuntu; Linux x86_64)', '(X11; Fedora; Linux x86_64)'])
+
+
+def _chromeos(rnd):
+    return '(X11; CrOS x86_64 %d.%d.0)' % (rnd.randint(14000, 16000), rnd.randint(0, 200))
+
+
+def _android(rnd):
+    model = rnd.choice(['SM-G991B', 'SM-A525F', 'Pixel 7', 'Pixel 8 Pro', 'M2101K6G', 'CPH2211', 'K'])
+    return '(Linux; Android %d; %s)' % (rnd.randint(9, 14), model)
+
+
+def _ios(rnd):
+    major = rnd.randint(15, 18)
+    version = '%d_%d' % (major, rnd.randint(0, 6))
+    if rnd.random() < 0.2:
+        return '(iPad; CPU OS %s like Mac OS X)' % version
+    return '(iPhone; CPU iPhone OS %s like Mac OS X)' % version
+
+
+def _chrome(rnd, mobile=False):
+    return ' AppleWebKit/537.36 (KHTML, like Gecko) Chrome/%s %sSafari/537.36' % (
+        CHROME[rnd.randint(100, 130)], 'Mobile ' if mobile else '')
+
+
+def _edge(rnd):
+    major = rnd.randint(100, 130)
+    return ' AppleWebKit/537.36 (KHTML, like Gecko) Chrome/%s Safari/537.36 Edg/%d.0.%d.%d' % (
+        CHROME[major], major, 1200 + 60 * (major - 90), rnd.randint(30, 99))
+
+
+def _opera(rnd):
+    return _chrome(rnd) + ' OPR/%d.0.%d.%d' % (rnd.randint(90, 115), rnd.randint(1000, 5000), rnd.randint(10, 99))
+
+
+def _firefox(rnd, comment):
+    version = '%d.0' % rnd.randint(100, 130)
+    return comment[:-1] + '; rv:%s) Gecko/20100101 Firefox/%s' % (version, version)
+
+
+def _safari(rnd, mobile=False):
+    major = rnd.randint(15, 18)
+    return ' AppleWebKit/605.1.15 (KHTML, like Gecko) Version/%d.%d %sSafari/604.1' % (
+        major, rnd.randint(0, 6), 'Mobile/15E148 ' if mobile else '')
+
+
+def browser_agent(rnd):
+    platform = rnd.random()
+    if platform < 0.45:
+        comment = rnd.choice([_windows, _windows, _windows, _mac, _linux, _chromeos])(rnd)
+        client = rnd.random()
+        if client < 0.6:
+            return 'Mozilla/5.0 ' + comment + _chrome(rnd)
+        if client < 0.75:
+            return 'Mozilla/5.0 ' + comment + _edge(rnd)
+        if client < 0.9:
+            return 'Mozilla/5.0 ' + _firefox(rnd, comment)
+        if client < 0.95 and comment.startswith('(Mac'):
+            return 'Mozilla/5.0 ' + comment + _safari(rnd)
+        return 'Mozilla/5.0 ' + comment + _opera(rnd)
+    if platform < 0.8:
+        comment = _android(rnd)
+        if rnd.random() < 0.9:
+            return 'Mozilla/5.0 ' + comment + _chrome(rnd, mobile=True)
+        version = '%d.0' % rnd.randint(100, 130)
+        return 'Mozilla/5.0 (Android %d; Mobile; rv:%s) Gecko/%s Firefox/%s' % (
+            rnd.randint(9, 14), version, version, version)
+    comment = _ios(rnd)
+    if rnd.random() < 0.85:
+        return 'Mozilla/5.0 ' + comment + _safari(rnd, mobile=True)
+    return 'Mozilla/5.0 ' + comment + ' AppleWebKit/605.1.15 (KHTML, like Gecko) CriOS/%s Mobile/15E148 Safari/604.1' % (
+        CHROME[rnd.randint(100, 130)])
+
+
+def bot_agent(rnd):
+    return rnd.choice([
+        'Mozilla/5.0 (compatible; Googlebot/2.1; +http://www.google.com/bot.html)',
+        'Mozilla/5.0 (Linux; Android 6.0.1; Nexus 5X Build/MMB29P) AppleWebKit/537.36 (KHTML, like Gecko) '
+        'Chrome/%s Mobile Safari/537.36 (compatible; Googlebot/2.1; +http://www.google.com/bot.html)' % CHROME[
+            rnd.randint(100, 130)],
+        'Mozilla/5.0 (compatible; bingbot/2.0; +http://www.bing.com/bingbot.htm)',
+        'Mozilla/5.0 (compatible; YandexBot/3.0; +http://yandex.com/bots)',
+        'Mozilla/5.0 (compatible; Baiduspider/2.0; +http://www.baidu.com/search/spider.html)',
+        'Mozilla/5.0 (compatible; AhrefsBot/7.0; +http://ahrefs.com/robot/)',
+        'Mozilla/5.0 (compatible; MJ12bot/v1.4.8; http://mj12bot.com/)',
+        'Mozilla/5.0 (compatible; DotBot/1.2; +https://opensiteexplorer.org/dotbot; help@moz.com)',
+        'facebookexternalhit/1.1 (+http://www.facebook.com/externalhit_uatext.php)',
+        'Twitterbot/1.0',
+        'LinkedInBot/1.0 (compatible; Mozilla/5.0; Apache-HttpClient +http://www.linkedin.com)',
+        'TelegramBot (like TwitterBot)',
+        'Mozilla/5.0 (compatible; Amazonbot/0.1; +https://developer.amazon.com/support/amazonbot)',
+    ])
+
+
+def device_agent(rnd):
+    return rnd.choice([
+        'Roku/DVP-%d.%d (%d.%d.%d.%d)' % (rnd.randint(9, 13), rnd.randint(0, 9), rnd.randint(9, 13),
+                                          rnd.randint(0, 9), rnd.randint(0, 9), rnd.randint(1000, 9999)),
+        'AppleTV11,1/11.1',
+        'AppleCoreMedia/1.0.0.%dA%d (Apple TV; U; CPU OS %d_%d like Mac OS X; en_us)' % (
+            rnd.randint(17, 21), rnd.randint(100, 999), rnd.randint(15, 18), rnd.randint(0, 6)),
+        'Mozilla/5.0 (PlayStation; PlayStation 5/%d.%02d) AppleWebKit/605.1.15 (KHTML, like Gecko)' % (
+            rnd.randint(2, 8), rnd.randint(0, 60)),
+        'Mozilla/5.0 (Windows NT 10.0; Win64; x64; Xbox; Xbox One) AppleWebKit/537.36 (KHTML, like Gecko) '
+        'Chrome/%s Safari/537.36 Edge/44.18363.8131' % CHROME[rnd.randint(100, 130)],
+        'Mozilla/5.0 (Linux; Android %d.0; BRAVIA 4K GB ATV3 Build/PTT1.190515.001.S52) AppleWebKit/537.36 '
+        '(KHTML, like Gecko) Chrome/%s Safari/537.36' % (rnd.randint(9, 12), CHROME[rnd.randint(100, 130)]),
+        'Mozilla/5.0 (X11; Linux armv7l) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/%s Safari/537.36 '
+        'CrKey/1.%d.%d' % (CHROME[rnd.randint(100, 130)], rnd.randint(50, 70), rnd.randint(100000, 300000)),
+        'Mozilla/5.0 (SMART-TV; LINUX; Tizen %d.0) AppleWebKit/537.36 (KHTML, like Gecko) Version/%d.0 '
+        'TV Safari/537.36' % (rnd.randint(5, 8), rnd.randint(5, 8)),
+    ])
+
+
+def client_agent(rnd):
+    return rnd.choice([
+        'curl/%d.%d.%d' % (7, rnd.randint(60, 88), rnd.randint(0, 3)),
+        'python-requests/2.%d.%d' % (rnd.randint(20, 32), rnd.randint(0, 3)),
+        'Python-urllib/3.%d' % rnd.randint(7, 12),
+        'okhttp/4.%d.%d' % (rnd.randint(0, 12), rnd.randint(0, 3)),
+        'Wget/1.%d.%d' % (rnd.randint(19, 21), rnd.randint(0, 4)),
+        'axios/1.%d.%d' % (rnd.randint(0, 7), rnd.randint(0, 9)),
+        'Java/%d.0.%d' % (rnd.randint(11, 21), rnd.randint(1, 20)),
+        'Go-http-client/%d.1' % rnd.randint(1, 2),
+        'Dalvik/2.1.0 (Linux; U; Android %d; %s Build/UP1A.231005.007)' % (
+            rnd.randint(9, 14), rnd.choice(['SM-G991B', 'Pixel 7', 'CPH2211'])),
+    ])
+
+
+def junk_agent(rnd, agents):
+    kind = rnd.random()
+    if kind < 0.3:
+        return ''.join(rnd.choice('abcdefghijklmnopqrstuvwxyz0123456789 /;().,-_') for _ in range(rnd.randint(1, 80)))
+    if kind < 0.5:
+        return ''.join(chr(rnd.randint(0x21, 0x2fff)) for _ in range(rnd.randint(1, 40)))
+    if kind < 0.8 and agents:
+        agent = rnd.choice(agents)
+        return agent[:rnd.randint(1, len(agent))]
+    # token soup: many detector tokens in one long agent
+    words = ['Mozilla/5.0', '(', ')', 'Chrome/', 'Safari', 'Android', 'Windows', 'like Gecko', 'Version/',
+             'iPhone', 'Edg/', 'OPR/', 'bot', ';', 'Firefox/', 'Mac OS X', 'Linux']
+    return ' '.join(rnd.choice(words) for _ in range(rnd.randint(50, 800)))
+
+
+def distinct_agents(count, seed=0):
+    """
+    => list of count distinct agents in popularity order, mostly browsers at
+    the top, with bots, devices and API clients further down
+    """
+    rnd = random.Random(seed)
+    # (share of the distinct agents, weight in the popularity order, maker)
+    kinds = [(0.8, 1.0, browser_agent), (0.88, 0.05, bot_agent), (0.93, 0.1, device_agent), (1.0, 0.2, client_agent)]
+    agents = {}
+    attempts = 0
+    while len(agents) < count and attempts < count * 50:
+        attempts += 1
+        roll = rnd.random()
+        for bound, weight, make in kinds:
+            if roll < bound:
+                agent = make(rnd)
+                if agent not in agents:
+                    # weighted random order: heavier kinds tend to come first
+                    agents[agent] = rnd.random() ** (1 / weight)
+                break
+    return sorted(agents, key=agents.get, reverse=True)
+
+
+def generate(lines, distinct=10000, zipf=1.1, junk=0.01, seed=0):
+    """
+    => yields lines agents, drawing from distinct_agents(distinct) with
+    Zipf(zipf) frequencies by rank and replacing a junk share with junk_agent()
+    """
+    pool = distinct_agents(distinct, seed)
+    rnd = random.Random(seed + 1)
+    cumulative = []
+    total = 0.0
+    for rank in range(1, len(pool) + 1):
+        total += rank ** -zipf
+        cumulative.append(total)
+    for _ in range(lines):
+        if rnd.random() < junk:
+            yield junk_agent(rnd, pool)
+        else:
+            yield pool[bisect.bisect_left(cumulative, rnd.random() * total)]
+
+
+def write(path, lines, **kw):
+    """
+    Write generate(lines, **kw) to path, one agent per line.
+    """
+    with open(path, 'w', encoding='utf-8') as f:
+        for agent in generate(lines, **kw):
+            f.write(agent.replace('\n', ' ').replace('\r', ' ') + '\n')
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Write a synthetic User-Agent corpus.')
+    parser.add_argument('path')
+    parser.add_argument('--lines', type=int, default=100000)
+    parser.add_argument('--distinct', type=int, default=10000, help='distinct agents drawn from')
+    parser.add_argument('--zipf', type=float, default=1.1, help='Zipf exponent of agent frequencies')
+    parser.add_argument('--junk', type=float, default=0.01, help='share of junk lines')
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args()
+    write(args.path, args.lines, distinct=args.distinct, zipf=args.zipf, junk=args.junk, seed=args.seed)
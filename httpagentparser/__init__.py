@@ -8,11 +8,258 @@ Tries to
     * assist python web apps to detect clients.
 """
 
+import bisect
+import gc
+import hashlib
+import json
+import marshal
+import os
+import sys
+import time
+from collections import Counter
+from functools import lru_cache
+
 __version__ = '1.9.5'
 
+# longer agents are cut (or rejected) before detection so one abusive header
+# can not cost more than a bounded amount of CPU; 0 disables the limit
+MAX_AGENT_LENGTH = 4096
+AGENT_OVERFLOW = 'truncate'  # or 'reject'
+
+# httpagentparser.metrics.Metrics collecting detect() statistics, see metrics.enable()
+_metrics = None
+
+
+def _resolved_before(cls, name, other):
+    """
+    => True if cls gets method name from a more derived class than method other
+    """
+    for klass in cls.__mro__:
+        if name in vars(klass):
+            return other not in vars(klass)
+        if other in vars(klass):
+            return False
+    return False
+
+
+class _Failed(object):
+    """
+    Marks a getVersion/getModel call that raised, see DetectorsHub.run
+    """
+
+
+ENGINES = ('reference', 'two_phase')
+
+
+def _leading_token(agent):
+    # "curl/7.68.0 (x86_64)" => "curl"
+    return agent.split('/', 1)[0].split(' ', 1)[0]
+
+
+def _look_for_tokens(detector):
+    # the words match() can return: an empty word is always found and ends the search
+    look_for = detector.look_for
+    words = []
+    for word in look_for if isinstance(look_for, (tuple, list)) else (look_for,):
+        if not word:
+            break
+        words.append(word)
+    return words
+
+
+def _always_runs(detector):
+    # detectors with their own checkWords/detect can not be judged by their tokens
+    return detector._legacy_match or type(detector).detect is not DetectorBase.detect
+
+
+class _TokenIndex(object):
+    """
+    One bit per distinct look_for/skip_if_found token of the detectors.
+
+    scan() computes the set of tokens present in an agent as a bitmask. A
+    token is only searched for when every shorter token it contains was
+    found, so "Googlebot-News" costs nothing on agents without "Googlebot".
+    Each detector's condition becomes two mask tests: one of its look_for
+    bits set and none of its skip_if_found bits.
+    """
+
+    def __init__(self, detectors):
+        self.detectors = detectors
+        self.always = [i for i, d in enumerate(detectors) if _always_runs(d)]
+        looks = [[] if i in self.always else _look_for_tokens(d) for i, d in enumerate(detectors)]
+        skips = [[] if i in self.always else list(d.skip_if_found) for i, d in enumerate(detectors)]
+        tokens = sorted(set(w for words in looks + skips for w in words if w), key=lambda w: (len(w), w))
+        self.bits = dict((w, 1 << i) for i, w in enumerate(tokens))
+        self.look = [self.mask_of(words) for words in looks]
+        # a skip word '' is always found: such a detector never matches
+        self.skip = [-1 if '' in words else self.mask_of(words) for words in skips]
+
+        users = dict((w, []) for w in tokens)
+        for i, words in enumerate(looks):
+            for w in words:
+                users[w].append(i)
+        children = dict((w, []) for w in tokens)
+        roots = []
+        self.inner = {}  # {token: mask of the shorter tokens it contains}
+        for n, w in enumerate(tokens):
+            parents = [t for t in tokens[:n] if t in w]
+            (children[parents[-1]] if parents else roots).append(w)
+            self.inner[w] = self.mask_of(parents)
+
+        def node(w):
+            return w, self.bits[w], tuple(users[w]), tuple(node(c) for c in children[w])
+
+        self.roots = tuple(node(w) for w in roots)
+
+    def state(self):
+        """
+        => the tables as JSON-able data, see from_state()
+        """
+        def node(n):
+            word, bit, users, children = n
+            return [word, list(users), [node(c) for c in children]]
+
+        return dict(always=self.always, tokens=list(self.bits), look=self.look, skip=self.skip,
+                    inner=[self.inner[w] for w in self.bits], roots=[node(n) for n in self.roots])
+
+    @classmethod
+    def from_state(cls, detectors, state):
+        """
+        => _TokenIndex of detectors from the state() of one built for the same detectors
+        """
+        index = cls.__new__(cls)
+        index.detectors = detectors
+        index.always = state['always']
+        index.bits = dict((w, 1 << i) for i, w in enumerate(state['tokens']))
+        index.look = state['look']
+        index.skip = state['skip']
+        index.inner = dict(zip(state['tokens'], state['inner']))
+
+        def node(n):
+            word, users, children = n
+            return word, index.bits[word], tuple(users), tuple(node(c) for c in children)
+
+        index.roots = tuple(node(n) for n in state['roots'])
+        return index
+
+    def mask_of(self, words):
+        mask = 0
+        for w in words:
+            mask |= self.bits.get(w, 0)
+        return mask
+
+    def scan(self, agent):
+        """
+        => (mask of the tokens in agent, indexes of detectors looking for one of them)
+        """
+        mask = 0
+        hits = []
+        pending = []
+        for word, bit, users, children in self.roots:
+            if word in agent:
+                mask |= bit
+                hits.extend(users)
+                pending.extend(children)
+        while pending:
+            word, bit, users, children = pending.pop()
+            if word in agent:
+                mask |= bit
+                hits.extend(users)
+                pending.extend(children)
+        return mask, hits
+
+    def select(self, mask, hits):
+        """
+        => the detectors that can match an agent scanned to (mask, hits), in detection order
+        """
+        skip = self.skip
+        return [self.detectors[i] for i in sorted(set(hits).union(self.always)) if not mask & skip[i]]
+
+
+class TokenProfile(object):
+    """
+    How often each detector token occurs in agents, see DetectorsHub.apply_token_profile().
+
+    hits: {token: agents holding it}
+    samples: agents counted
+    """
+
+    def __init__(self, hits=None, samples=0):
+        self.hits = Counter(hits or {})
+        self.samples = samples
+
+    def add(self, agent, index):
+        """
+        index: _TokenIndex whose tokens are counted
+        """
+        mask = index.scan(agent)[0]
+        if mask:
+            self.hits.update(word for word, bit in index.bits.items() if mask & bit)
+        self.samples += 1
+
+    def rate(self, word):
+        return self.hits[word] / self.samples if self.samples else 0.0
+
+    def save(self, path):
+        with open(path, 'w', encoding='utf-8') as f:
+            json.dump(dict(samples=self.samples, hits=self.hits), f, sort_keys=True)
+
+    @classmethod
+    def load(cls, path):
+        with open(path, encoding='utf-8') as f:
+            profile = json.load(f)
+        return cls(profile['hits'], profile['samples'])
+
+
+class _TokenSampler(object):
+    """
+    DetectorsHub.run() hook filling a TokenProfile, see DetectorsHub.enable_token_profiling().
+    """
+
+    def __init__(self, profile, every, target):
+        self.profile = profile
+        self.every = every
+        self.target = target
+        self.calls = 0
+
+    def observe(self, agent, hub):
+        # count every self.every'th agent, apply once self.target are counted
+        self.calls += 1
+        if self.calls % self.every:
+            return
+        self.profile.add(agent, hub.token_index())
+        if self.profile.samples >= self.target:
+            hub.token_sampler = None
+            hub.apply_token_profile(self.profile)
+
+
+class _DispatchEntry(object):
+    """
+    Detectors to run for agents starting with one product token, valid as long
+    as none of its residual tokens (see DetectorsHub.dispatch_table) occurs.
+    words: the residual tokens not containing a shorter one, enough to test that
+    """
+    __slots__ = ('detectors', 'words')
+
+    def __init__(self, detectors, words):
+        self.detectors = detectors
+        self.words = words
+
+
+_UNBUILT = object()  # dispatch table entry built on first use
+
 
 class DetectorsHub(dict):
     _known_types = ['os', 'dist', 'flavor', 'browser']
+    engine = 'reference'  # see ENGINES
+    dispatch = True  # route agents by their leading product token, see candidates()
+    prefilter = True  # skip detectors by token presence, see candidates()
+    negative_cache = None  # sketches.BloomFilter of agents that matched nothing, see enable_negative_cache()
+    exact_table = None  # {agent: FrozenDict} detect() answers before any detector runs, see load_exact_table()
+    token_sampler = None  # _TokenSampler fed by run(), see enable_token_profiling()
+    token_profile = None  # TokenProfile ordering the dispatch residual words, see apply_token_profile()
+    # lazily built tables, dropped by register() and built up front by compile()
+    _compiled = ('_detectors', '_fingerprints', '_tokens', '_dispatch')
 
     def __init__(self, *args, **kw):
         dict.__init__(self, *args, **kw)
@@ -21,6 +268,11 @@ class DetectorsHub(dict):
         self.registerDetectors()
 
     def register(self, detector):
+        for name in self._compiled:
+            setattr(self, name, None)
+        if self.negative_cache is not None:
+            self.negative_cache.clear()
+        self.exact_table = None
         if detector.info_type not in self._known_types:
             self[detector.info_type] = [detector]
             self._known_types.insert(detector.order, detector.info_type)
@@ -36,6 +288,389 @@ class DetectorsHub(dict):
             if d.can_register:
                 self.register(d)
 
+    def fingerprints(self):
+        """
+        => [(detector_id, fingerprint), ...] in detection order
+        """
+        if self._fingerprints is None:
+            self._fingerprints = [(d.detector_id, d.fingerprint()) for typ in self for d in self[typ]]
+        return self._fingerprints
+
+    def fingerprint(self):
+        """
+        => hex digest identifying the registered detectors, their code and tokens
+        Changes whenever a detector is added, removed, reordered or retuned.
+        """
+        return hashlib.sha1(repr(self.fingerprints()).encode('utf-8')).hexdigest()
+
+    def detectors(self):
+        """
+        => all registered detectors in detection order
+        """
+        if self._detectors is None:
+            self._detectors = [d for typ in self for d in self.get(typ, ())]
+            self._two_phase = all(type(d).detect is DetectorBase.detect for d in self._detectors)
+        return self._detectors
+
+    def token_index(self):
+        """
+        => _TokenIndex of the registered detectors
+        """
+        if self._tokens is None:
+            self._tokens = _TokenIndex(self.detectors())
+        return self._tokens
+
+    def dispatch_table(self):
+        """
+        => {leading product token: _DispatchEntry}
+
+        Every product name a detector looks for ("curl" for "curl/") gets an
+        entry listing the detectors that look for it or a part of it, plus
+        those overriding checkWords/detect, which always run. Entry None
+        serves other leading tokens: agents without any known token skip
+        straight to the always run detectors. The entry is looked up before
+        any token scan, and only its residual words are searched for.
+        candidates() builds entries as their tokens come up; this builds all.
+        """
+        table = self._dispatch_keys()
+        for key, entry in table.items():
+            if entry is _UNBUILT:
+                self._dispatch_entry(key)
+        return table
+
+    def _dispatch_keys(self):
+        # => the dispatch table with _UNBUILT for the entries not built yet
+        if self._dispatch is None:
+            index = self.token_index()
+            keys = set(_leading_token(w) for d in index.detectors for w in _look_for_tokens(d))
+            keys.discard('')
+            self._dispatch = dict.fromkeys(keys, _UNBUILT)
+            self._dispatch[None] = _UNBUILT
+        return self._dispatch
+
+    def _dispatch_entry(self, key):
+        index = self.token_index()
+        always = set(index.always)
+        if key is None:
+            primary = [i in always for i in range(len(index.detectors))]
+        else:
+            # the detectors looking for key or a part of it
+            wanted = 0
+            for w, bit in index.bits.items():
+                if w.startswith(key) or w in key:
+                    wanted |= bit
+            primary = [i in always or bool(look & wanted) for i, look in enumerate(index.look)]
+        # any token of another detector, or one that skips a listed detector, voids the entry
+        residual = 0
+        for i, p in enumerate(primary):
+            residual |= index.skip[i] if p else index.look[i]
+        if residual == -1:
+            words = ('',)  # a skip word '' is always found
+        else:
+            # a residual word holding a shorter residual word is found only along with it
+            inner = index.inner
+            words = tuple(w for w, bit in index.bits.items() if residual & bit and not residual & inner[w])
+            profile = self.token_profile
+            if profile is not None:
+                words = tuple(sorted(words, key=lambda w: -profile.rate(w)))
+        entry = self._dispatch[key] = _DispatchEntry([d for d, p in zip(index.detectors, primary) if p], words)
+        return entry
+
+    def candidates(self, agent):
+        """
+        => the detectors that can match agent, in detection order
+
+        The tokens present in agent are collected once (see _TokenIndex), and
+        detectors whose look_for tokens are all absent or whose skip_if_found
+        tokens occur are left out; the result is the same as running them all.
+        With dispatch on, an agent whose leading product token is indexed and
+        that holds no token of other detectors takes a precomputed list
+        without the scan; only that entry's residual words are searched for.
+        """
+        if self.dispatch:
+            key = _leading_token(agent)
+            entry = (self._dispatch or self._dispatch_keys()).get(key)
+            if entry is None and not self.prefilter:
+                key = None  # the scan below finds the same for these
+                entry = self._dispatch[None]
+            if entry is _UNBUILT:
+                entry = self._dispatch_entry(key)
+            if entry is not None:
+                for word in entry.words:
+                    if word in agent:
+                        break
+                else:
+                    return entry.detectors
+        if self.prefilter:
+            index = self.token_index()
+            return index.select(*index.scan(agent))
+        return self.detectors()
+
+    def enable_negative_cache(self, capacity=100000, error=0.0001):
+        """
+        Remember agents no detector can match, so repeats return the empty
+        result without scanning. A false positive (probability error) makes a
+        matching agent come out empty too; register() forgets everything.
+        => the BloomFilter used
+        """
+        from .sketches import BloomFilter
+        self.negative_cache = BloomFilter(capacity, error)
+        return self.negative_cache
+
+    def profile_tokens(self, agents):
+        """
+        => TokenProfile of the detector tokens in agents, e.g. a sample of an access log
+        """
+        profile = TokenProfile()
+        index = self.token_index()
+        for agent in agents:
+            profile.add(decode_agent(agent), index)
+        return profile
+
+    def apply_token_profile(self, profile):
+        """
+        Search the residual words of every dispatch entry most frequent first,
+        so an agent holding one falls back to the scan sooner, and check the
+        skip_if_found words of every detector most frequent first, so match()
+        stops at the first one found sooner (this only pays with prefilter
+        off: the candidates it leaves hold none of their skip words). Neither
+        decision depends on the order, unlike look_for whose first word found
+        picks the version marker, so look_for keeps its declaration order.
+        profile: TokenProfile, None to restore declaration order
+        """
+        self.token_profile = profile
+        if self._dispatch is not None:
+            # rebuilt on use in the new order
+            self._dispatch = dict.fromkeys(self._dispatch, _UNBUILT)
+        for d in self.detectors():
+            if profile is None or not d.skip_if_found:
+                d._skip_order = None
+            else:
+                d._skip_order = sorted(d.skip_if_found, key=lambda w: -profile.rate(w))
+
+    def enable_token_profiling(self, every=100, samples=1000):
+        """
+        Count the tokens of every every'th agent run() sees and apply the
+        profile once samples agents are counted (see apply_token_profile).
+        => the TokenProfile being filled, save() it to reuse with TokenProfile.load()
+        """
+        if every < 1 or samples < 1:
+            raise ValueError('every and samples must be at least 1')
+        profile = TokenProfile()
+        self.token_sampler = _TokenSampler(profile, every, samples)
+        return profile
+
+    def compile(self):
+        """
+        Build all lazily computed tables now, e.g. before forking workers.
+        """
+        self.detectors()
+        self.fingerprints()
+        self.token_index()
+        self.dispatch_table()
+        return self
+
+    def signature(self):
+        """
+        => cheap key of the registered detectors and the files defining them
+        Used to validate snapshots without computing fingerprints.
+        """
+        parts = [__version__]
+        files = set()
+        for d in self.detectors():
+            parts.append((d.detector_id, sorted((k, repr(v)) for k, v in vars(d).items() if not k.startswith('_'))))
+            files.add(getattr(sys.modules.get(type(d).__module__), '__file__', None))
+        for path in sorted(f for f in files if f):
+            st = os.stat(path)
+            parts.append((path, st.st_size, st.st_mtime_ns))
+        return hashlib.sha1(repr(parts).encode('utf-8')).hexdigest()
+
+    def save_snapshot(self, path):
+        """
+        Compile and write the tables that are costly to rebuild to path as
+        JSON: the detector fingerprints, the token index and the dispatch
+        table, tagged with __version__ and fingerprint() like the exact-match
+        table, plus signature() to check them against without fingerprinting.
+        """
+        self.compile()
+        position = dict((id(d), i) for i, d in enumerate(self.detectors()))
+        dispatch = [[key, [position[id(d)] for d in entry.detectors], entry.words]
+                    for key, entry in self._dispatch.items()]
+        with open(path, 'w', encoding='utf-8') as f:
+            json.dump(dict(version=__version__, fingerprint=self.fingerprint(), signature=self.signature(),
+                           fingerprints=self._fingerprints, tokens=self._tokens.state(), dispatch=dispatch), f)
+
+    def load_snapshot(self, path):
+        """
+        => True if path held a snapshot of this very hub and it was loaded
+        """
+        try:
+            with open(path, encoding='utf-8') as f:
+                snapshot = json.load(f)
+        except (OSError, ValueError):
+            return False
+        if snapshot.get('version') != __version__ or snapshot.get('signature') != self.signature():
+            return False
+        fingerprints = [tuple(item) for item in snapshot['fingerprints']]
+        if hashlib.sha1(repr(fingerprints).encode('utf-8')).hexdigest() != snapshot['fingerprint']:
+            return False
+        detectors = self.detectors()
+        self._fingerprints = fingerprints
+        self._tokens = _TokenIndex.from_state(detectors, snapshot['tokens'])
+        self._dispatch = dict((key, _DispatchEntry([detectors[i] for i in entry], tuple(words)))
+                              for key, entry, words in snapshot['dispatch'])
+        if self.token_profile is not None:
+            self.apply_token_profile(self.token_profile)
+        return True
+
+    def build_exact_table(self, agents, size=500):
+        """
+        => {agent: result} of the size most common agents
+        agents: corpus to count, e.g. the lines of an access log; bytes are decoded
+        Agents detect() would truncate or reject (see MAX_AGENT_LENGTH) are left out.
+        """
+        counts = Counter(decode_agent(agent).strip() for agent in agents)
+        table = {}
+        for agent, _ in counts.most_common():
+            if len(table) >= size:
+                break
+            if not agent or MAX_AGENT_LENGTH and len(agent) > MAX_AGENT_LENGTH:
+                continue
+            result = dict(platform=dict(name=None, version=None))
+            self.run(agent, result)
+            table[agent] = result
+        return table
+
+    def save_exact_table(self, path, agents, size=500):
+        """
+        Write the exact-match table of the size most common agents to path as
+        JSON, tagged with __version__ and fingerprint() so that it is only
+        loaded by the library and detectors it was built with.
+        """
+        table = self.build_exact_table(agents, size)
+        with open(path, 'w', encoding='utf-8') as f:
+            json.dump(dict(version=__version__, fingerprint=self.fingerprint(), results=table), f,
+                      indent=0, sort_keys=True, ensure_ascii=False)
+
+    def load_exact_table(self, path):
+        """
+        => True if path held a table built by save_exact_table() with this
+        version and these detectors and it is now in use
+        """
+        try:
+            with open(path, encoding='utf-8') as f:
+                table = json.load(f)
+        except (OSError, ValueError):
+            return False
+        if table.get('version') != __version__ or table.get('fingerprint') != self.fingerprint():
+            return False
+        self.exact_table = dict((agent, freeze_result(result)) for agent, result in table['results'].items())
+        return True
+
+    def run(self, agent, result, engine=None, matched=None):
+        """
+        Run the detectors over agent, writing into result.
+        engine: one of ENGINES, self.engine by default
+        matched: list to collect the ids of the matching detectors in
+        """
+        engine = engine or self.engine
+        if engine not in ENGINES:
+            raise ValueError('unknown engine %r' % engine)
+        if self.token_sampler is not None:
+            self.token_sampler.observe(agent, self)
+        negative = self.negative_cache
+        if negative is not None and agent in negative:
+            return
+        detectors = self.candidates(agent)
+        if not detectors:
+            # none of the detectors' tokens occur: nothing to run
+            if negative is not None:
+                negative.add(agent)
+        elif engine == 'two_phase' and self._two_phase:
+            self._run_two_phase(agent, result, detectors, matched)
+        else:
+            self._run_reference(agent, result, detectors, matched)
+
+    def _run_reference(self, agent, result, detectors, matched):
+        # every matching detector writes its result, later matches overwrite earlier ones
+        for detector in detectors:
+            try:
+                if matched is not None and detector.checkWords(agent):
+                    matched.append(detector.detector_id)
+                detector.detect(agent, result)
+            except Exception as _err:
+                if _metrics is not None:
+                    _metrics.swallowed(detector, _err)
+
+    def _run_two_phase(self, agent, result, detectors, matched):
+        """
+        Same result as _run_reference, but getVersion/getModel only run for
+        the detectors whose output survives the last-wins overwrites.
+        """
+        hits = []
+        for detector in detectors:
+            try:
+                hit = detector.match(agent)
+            except Exception as _err:
+                if _metrics is not None:
+                    _metrics.swallowed(detector, _err)
+                continue
+            if hit:
+                hits.append((detector,) + hit)
+        if matched is not None:
+            matched.extend(hit[0].detector_id for hit in hits)
+        if not hits:
+            return
+
+        versions = {}
+
+        def version(i):
+            if i not in versions:
+                detector, word, pos = hits[i]
+                try:
+                    versions[i] = detector.versionFor(agent, word, pos)
+                except Exception as _err:
+                    if _metrics is not None:
+                        _metrics.swallowed(detector, _err)
+                    versions[i] = _Failed
+            return versions[i]
+
+        winners = {}
+        for i, hit in enumerate(hits):
+            winners[hit[0].info_type] = i
+        for n, (info_type, i) in enumerate(winners.items()):
+            result[info_type] = dict(name=hits[i][0].name)
+            v = version(i)
+            if v is not _Failed and v:
+                result[info_type]['version'] = v
+            if not n:
+                result['bot'] = hits[-1][0].bot
+
+        # platform and model come from the last detector that got that far without raising
+        for i in range(len(hits) - 1, -1, -1):
+            platform = hits[i][0].platform
+            if platform and version(i) is not _Failed:
+                result['platform'] = {'name': platform, 'version': versions[i]}
+                break
+        for i in range(len(hits) - 1, -1, -1):
+            detector, word, pos = hits[i]
+            try:
+                model = detector.modelAt(agent, word, pos)
+            except Exception as _err:
+                if _metrics is not None:
+                    _metrics.swallowed(detector, _err)
+                continue
+            if version(i) is not _Failed:
+                result['model'] = model
+                break
+
+
+class NoModel(AttributeError):
+    """
+    Raised by modelAt() for detectors without model_markers or a getModel()
+    of their own, where the stock getModel() would fail looking the markers up.
+    """
+
 
 class DetectorBase(object):
     name = ""  # "to perform match in DetectorsHub object"
@@ -48,6 +683,7 @@ class DetectorBase(object):
     version_markers = [("/", " ")]
     allow_space_in_version = False
     _suggested_detectors = None
+    _skip_order = None  # skip_if_found in the order match() checks it, see DetectorsHub.apply_token_profile()
     platform = None
     bot = False
     model = ""
@@ -56,22 +692,72 @@ class DetectorBase(object):
         if not self.name:
             self.name = self.__class__.__name__
         self.can_register = (self.__class__.__dict__.get('can_register', True))
+        # subclasses written against checkWords/getVersion keep working through adapters
+        self._legacy_match = _resolved_before(self.__class__, 'checkWords', 'match')
+        self._legacy_version = _resolved_before(self.__class__, 'getVersion', 'versionAt')
+
+    @property
+    def detector_id(self):
+        return '%s.%s' % (self.info_type, self.__class__.__name__)
+
+    def fingerprint(self):
+        """
+        => hex digest of the detector's code, tables and tokens
+        """
+        import inspect  # costs more import time than the rest of the module
+        h = hashlib.sha1()
+        for klass in self.__class__.__mro__[:-1]:
+            for attr, value in sorted(vars(klass).items()):
+                if attr.startswith('__'):
+                    continue
+                value = getattr(value, '__func__', value)
+                if inspect.isfunction(value):
+                    try:
+                        value = inspect.getsource(value)
+                    except (OSError, TypeError):
+                        value = marshal.dumps(value.__code__)
+                elif isinstance(value, property):
+                    value = marshal.dumps(value.fget.__code__)
+                h.update(repr((klass.__name__, attr, value)).encode('utf-8'))
+        h.update(repr(sorted((k, v) for k, v in vars(self).items() if not k.startswith('_'))).encode('utf-8'))
+        return h.hexdigest()
 
     def detect(self, agent, result):
         # -> True/None
-        word = self.checkWords(agent)
-        if word:
+        hit = self.match(agent)
+        if hit:
+            word, pos = hit
             result[self.info_type] = dict(name=self.name)
             result['bot'] = self.bot
-            version = self.getVersion(agent, word)
+            version = self.versionFor(agent, word, pos)
             if version:
                 result[self.info_type]['version'] = version
             if self.platform:
                 result['platform'] = {'name': self.platform, 'version': version}
-            result['model'] = self.getModel(agent, word)
+            result['model'] = self.modelAt(agent, word, pos)
 
             return True
 
+    def match(self, agent):
+        """
+        => (matched word, its offset in agent) / None
+        Same decision as checkWords, but the offset saves extractors a re-scan.
+        """
+        if self._legacy_match:
+            word = self.checkWords(agent)
+            if word:
+                return word, agent.find(word) if isinstance(word, str) else -1
+            return None
+        skip = self._skip_order
+        for w in self.skip_if_found if skip is None else skip:
+            if w in agent:
+                return None
+        look_for = self.look_for
+        for word in look_for if isinstance(look_for, (tuple, list)) else (look_for,):
+            pos = agent.find(word)
+            if pos >= 0:
+                return (word, pos) if word else None
+
     def checkWords(self, agent):
         # -> True/None
         for w in self.skip_if_found:
@@ -84,13 +770,25 @@ class DetectorBase(object):
         elif self.look_for in agent:
             return self.look_for
 
+    def versionFor(self, agent, word, pos):
+        if self._legacy_version:
+            return self.getVersion(agent, word)
+        return self.versionAt(agent, word, pos)
+
     def getVersion(self, agent, word):
         """
         => version string /None
         """
+        return self.versionAt(agent, word, agent.find(word))
+
+    def versionAt(self, agent, word, pos):
+        """
+        pos: offset of word in agent as found by match, -1 if unknown
+        => version string /None
+        """
         version_markers = self.version_markers if \
             isinstance(self.version_markers[0], (list, tuple)) else [self.version_markers]
-        version_part = agent.split(word, 1)[-1]
+        version_part = agent[pos + len(word):] if pos >= 0 else agent.split(word, 1)[-1]
         for start, end in version_markers:
             if version_part.startswith(start) and end in version_part:
                 version = version_part[1:]
@@ -116,6 +814,15 @@ class DetectorBase(object):
                     model = model.split()[0]
                 return model
 
+    def modelAt(self, agent, word, pos):
+        """
+        pos: offset of word in agent as found by match, -1 if unknown
+        => model string /None
+        """
+        if type(self).getModel is DetectorBase.getModel and not hasattr(self, 'model_markers'):
+            raise NoModel(self.detector_id)
+        return self.getModel(agent, word)
+
 
 class OS(DetectorBase):
     info_type = "os"
@@ -226,9 +933,10 @@ class MSEdge(Browser):
 class ChromiumEdge(Browser):
     look_for = "Edg/"
 
-    def getVersion(self, agent, word):
-        if "Edg/" in agent:
-            return agent.split('Edg/')[-1].split(' ')[0].strip()
+    def versionAt(self, agent, word, pos):
+        i = agent.rfind(word, max(pos, 0))
+        if i >= 0:
+            return agent[i + len(word):].split(' ')[0].strip()
 
 
 class Galeon(Browser):
@@ -244,15 +952,7 @@ class WOSBrowser(Browser):
 
 class Safari(Browser):
     look_for = "Safari"
-    skip_if_found = ["Edge", "YaBrowser", "FxiOS"]
-
-    def checkWords(self, agent):
-        unless_list = ["Chrome", "OmniWeb", "wOSBrowser", "Android", "CriOS", "OPX", "Ddg"]
-        if self.look_for in agent:
-            for word in unless_list:
-                if word in agent:
-                    return False
-            return self.look_for
+    skip_if_found = ["Chrome", "OmniWeb", "wOSBrowser", "Android", "CriOS", "OPX", "Ddg"]
 
     def getVersion(self, agent, word):
         if "Version/" in agent:
@@ -1333,15 +2033,7 @@ class Windows(OS):
     def getVersion(self, agent, word):
       if 'OS: ' in agent:
         v = agent.split('OS: ')[-1].split(' ')[0].strip()
-        for key in self.win_versions.keys():
-          if v in key:
-            return self.win_versions.get(key)
-        values = {key: value for key, value in self.win_versions.items() if key in v}
-        #grab just the first value in case it is an empty dictionary and if so set to 'unknown'
-        ver = next(iter(values.values()), None)
-        if ver == None:
-          ver = v
-        return ver
+        return self.lookupVersion(v)
       elif 'Windows-Update-Agent' in agent:
         #may be able to breakdown version to OS build at later date
         return 'Unknown'
@@ -1356,26 +2048,10 @@ class Windows(OS):
         return self.win_versions.get(v, v)
       elif 'Windows/' in agent:
         v = agent.split('Windows/')[-1].split(' ')[0].strip()
-        for key in self.win_versions.keys():
-          if v in key:
-            return self.win_versions.get(key)
-        values = {key: value for key, value in self.win_versions.items() if key in v}
-        #grab just the first value in case it is an empty dictionary and if so set to 'unknown'
-        ver = next(iter(values.values()), None)
-        if ver == None:
-          ver = v
-        return ver
+        return self.lookupVersion(v)
       elif 'PC-Windows;' in agent:
         v = agent.split('PC-Windows;')[-1].split(';')[0].strip()
-        for key in self.win_versions.keys():
-          if v in key:
-            return self.win_versions.get(key)
-        values = {key: value for key, value in self.win_versions.items() if key in v}
-        #grab just the first value in case it is an empty dictionary and if so set to 'unknown'
-        ver = next(iter(values.values()), None)
-        if ver == None:
-          ver = v
-        return ver
+        return self.lookupVersion(v)
       else:
         v = agent.split('Windows')[-1].replace(',', ';').split(';')[0].replace('/', '').strip()
         if ')' in v:
@@ -1383,16 +2059,17 @@ class Windows(OS):
         elif v == '':
           return 'Unknown'
 
+        return self.lookupVersion(v)
+
+    def lookupVersion(self, v):
         for key in self.win_versions.keys():
           if v in key:
             return self.win_versions.get(key)
-
-        values = {key: value for key, value in self.win_versions.items() if key in v}
-        #grab just the first value in case it is an empty dictionary and if so set to 'unknown'
-        ver = next(iter(values.values()), None)
-        if ver == None:
-          ver = v
-        return ver
+        #otherwise the first known key found in v, stopping at the first hit; v itself if none
+        for key, value in self.win_versions.items():
+          if key in v:
+            return value
+        return v
 
 
 class Ubuntu(Dist):
@@ -1460,8 +2137,11 @@ class Chrome(Browser):
     version_markers = ["/", " "]
     skip_if_found = [" OPR", "Edge", "YaBrowser", "Edg/", "YandexBot", "bingbot", "amazonbot", "OPX", "GuardianBrowser"]
 
-    def getVersion(self, agent, word):
-        part = agent.split(word + self.version_markers[0])[-1]
+    def versionAt(self, agent, word, pos):
+        # the last "<word>/" can only start at or after the first match of word
+        marker = word + self.version_markers[0]
+        i = agent.rfind(marker, max(pos, 0))
+        part = agent[i + len(marker):] if i >= 0 else agent
         version = part.split(self.version_markers[1])[0]
         if '+' in version:
             version = version.split('+')[0]
@@ -1473,8 +2153,11 @@ class YaBrowser(Browser):
     name = "Yandex.Browser"
     version_markers = ["/", " "]
 
-    def getVersion(self, agent, word):
-        part = agent.split(word + self.version_markers[0])[-1]
+    def versionAt(self, agent, word, pos):
+        # the last "<word>/" can only start at or after the first match of word
+        marker = word + self.version_markers[0]
+        i = agent.rfind(marker, max(pos, 0))
+        part = agent[i + len(marker):] if i >= 0 else agent
         version = part.split(self.version_markers[1])[0]
         if '+' in version:
             version = version.split('+')[0]
@@ -1629,23 +2312,228 @@ class prefs:  # experimental
     )
 
 
+# macOS 11+ browsers freeze the OS token at 10.15.7; only Safari's own version
+# hints at the real OS. Both tables will have to be updated periodically.
+FROZEN_MACOS_VERSION = '10.15.7'
+CHROME_FROZEN_MACOS = 'Mac OS X 11.x;Mac OS X 12.x;Mac OS X 13.x;Mac OS X 14.x;Mac OS X 26.x'
+SAFARI_FROZEN_MACOS = (
+    # (first Safari version, macOS range), sorted
+    ((14,), 'Mac OS X 11.0 - 11.2'),
+    ((14, 1), 'Mac OS X 11.3+'),
+    ((15,), 'Mac OS X 12.0'),
+    ((15, 2), 'Mac OS X 12.1'),
+    ((15, 3), 'Mac OS X 12.2'),  # guess, not documented
+    ((15, 4), 'Mac OS X 12.3'),
+    ((15, 5), 'Mac OS X 12.4'),
+    ((15, 6), 'Mac OS X 12.5+'),
+    ((16,), 'Mac OS X 11.x;Mac OS X 12.x'),
+    ((16, 1), 'Mac OS X 11.x;Mac OS X 12.x;Mac OS X 13.x'),
+    ((17,), 'Mac OS X 12.x;Mac OS X 13.x;Mac OS X 14.x'),
+    ((18,), 'Mac OS X 13.x;Mac OS X 14.x;Mac OS X 15'),
+    ((18, 0, 1), 'Mac OS X 13.x;Mac OS X 14.x;Mac OS X 15.0.1'),
+    ((18, 1), 'Mac OS X 13.x;Mac OS X 14.x;Mac OS X 15.1'),
+    ((18, 2), 'Mac OS X 13.x;Mac OS X 14.x;Mac OS X 15.2'),
+    ((18, 3), 'Mac OS X 13.x;Mac OS X 14.x;Mac OS X 15.3'),
+    ((18, 4), 'Mac OS X 13.x;Mac OS X 14.x;Mac OS X 15.4'),
+    ((18, 5), 'Mac OS X 13.x;Mac OS X 14.x;Mac OS X 15.5'),
+    ((18, 6), 'Mac OS X 13.x;Mac OS X 14.x;Mac OS X 15.6'),
+    ((19,), None),  # Safari skipped 19 - 25
+    ((26,), 'Mac OS X 14.x;Mac OS X 15.x;Mac OS X 26'),
+    ((26, 1), 'Mac OS X 14.x;Mac OS X 15.x;Mac OS X 26.1'),
+    ((26, 2), 'Mac OS X 14.x;Mac OS X 15.x;Mac OS X 26.2'),
+    ((26, 3), 'Mac OS X 14.x;Mac OS X 15.x;Mac OS X 26.3'),
+    ((27,), None),
+)
+_safari_frozen_keys = [version for version, _ in SAFARI_FROZEN_MACOS]
+
+
+def version_tuple(version):
+    """
+    "17.4.1" => (17, 4, 1); parsing stops at the first non numeric part
+    """
+    parts = []
+    for part in (version or '').split('.'):
+        if not part.isdigit():
+            break
+        parts.append(int(part))
+    return tuple(parts)
+
+
+@lru_cache(maxsize=1024)
+def infer_frozen_macos(browser, version):
+    """
+    => probable macOS range(s) behind a frozen 10.15.7 token, ';' separated, or None
+    """
+    if browser == 'Chrome':
+        return CHROME_FROZEN_MACOS
+    if browser == 'Safari':
+        idx = bisect.bisect_right(_safari_frozen_keys, version_tuple(version)) - 1
+        if idx >= 0:
+            return SAFARI_FROZEN_MACOS[idx][1]
+
+
+def _infer_frozen_os(result):
+    flavor = result.get('flavor')
+    browser = result.get('browser')
+    if flavor and browser and (flavor.get('version') or '').endswith(FROZEN_MACOS_VERSION):
+        inferred = infer_frozen_macos(browser.get('name'), browser.get('version'))
+        if inferred:
+            flavor['inferred'] = inferred
+
+
 detectorshub = DetectorsHub()
 
 
-def detect(agent, fill_none=False):
+class FrozenDict(dict):
+    """
+    Read-only dict returned by detect(frozen=True). Equal results are one
+    shared instance (see freeze_result), so they can be cached and handed
+    out without copies. thaw_result(result) gives a mutable copy; dict(result)
+    or result.copy() only copies the top level, result['os'] stays frozen.
+    """
+    __slots__ = ('_hash', '_simple_tuple', '_simple')
+
+    def _readonly(self, *args, **kw):
+        raise TypeError('frozen detect() result, copy it with dict() to modify')
+
+    __setitem__ = __delitem__ = __ior__ = clear = pop = popitem = setdefault = update = _readonly
+
+    def __hash__(self):
+        try:
+            return self._hash
+        except AttributeError:
+            self._hash = hash(frozenset(self.items()))
+            return self._hash
+
+    def __reduce__(self):
+        return FrozenDict, (dict(self),)
+
+
+# interned frozen results; started over when full so odd agents can not grow it forever
+MAX_INTERNED_RESULTS = 65536
+_interned = {}
+
+
+def freeze_result(result):
     """
+    => FrozenDict equal to the detect() result, the same object for equal results
+    Nested dicts become FrozenDicts and lists become tuples.
+    """
+    if isinstance(result, FrozenDict):
+        return result
+    frozen = FrozenDict((key, freeze_result(value) if isinstance(value, dict) else
+                         tuple(value) if isinstance(value, list) else value)
+                        for key, value in result.items())
+    shared = _interned.get(frozen)
+    if shared is None:
+        if len(_interned) >= MAX_INTERNED_RESULTS:
+            _interned.clear()
+        shared = _interned[frozen] = frozen
+    return shared
+
+
+def thaw_result(result):
+    """
+    => mutable deep copy of a (frozen) detect() result: FrozenDicts become
+    dicts and tuples lists again
+    """
+    return dict((key, thaw_result(value) if isinstance(value, dict) else
+                 list(value) if isinstance(value, (list, tuple)) else value)
+                for key, value in result.items())
+
+
+def warmup(snapshot=None, cached=None, freeze=True, exact_table=None):
+    """
+    Prepare the parser in a pre-fork master process.
+
+    snapshot: hub snapshot file; loaded if it matches detectorshub, else written after compiling
+    cached: CachedDetector to preload from its persistent store
+    exact_table: file written by DetectorsHub.save_exact_table(), loaded if it matches detectorshub
+    freeze: gc.freeze() afterwards so forked workers share these pages copy-on-write
+    """
+    loaded = snapshot is not None and detectorshub.load_snapshot(snapshot)
+    detectorshub.compile()
+    if snapshot is not None and not loaded:
+        detectorshub.save_snapshot(snapshot)
+    if exact_table is not None:
+        detectorshub.load_exact_table(exact_table)
+    if cached is not None:
+        cached.warm()
+    if freeze:
+        gc.collect()
+        gc.freeze()
+
+
+def decode_agent(agent, max_length=0):
+    """
+    bytes/bytearray/memoryview agent => str, invalid UTF-8 replaced by U+FFFD
+    max_length: only the bytes needed for the first max_length + 1 characters are decoded, 0 for all
+    """
+    if isinstance(agent, str):
+        return agent
+    # a character takes at most 4 bytes, so the characters before the cut decode as in the whole buffer
+    if max_length and len(agent) > 4 * (max_length + 1):
+        agent = agent[:4 * (max_length + 1)]
+    return str(agent, 'utf-8', 'replace')
+
+
+def _bounded_agent(agent, max_length=None, overflow=None):
+    # => the str detect() runs the detectors on, see its max_length and overflow
+    if max_length is None:
+        max_length = MAX_AGENT_LENGTH
+    if agent is None:
+        return ''  # no header: nothing is detected
+    if not isinstance(agent, str):
+        agent = decode_agent(agent, max_length)
+    if max_length and len(agent) > max_length:
+        overflow = overflow or AGENT_OVERFLOW
+        if overflow == 'truncate':
+            return agent[:max_length]
+        if overflow == 'reject':
+            return ''
+        raise ValueError("overflow must be 'truncate' or 'reject', not %r" % overflow)
+    return agent
+
+
+def detect(agent, fill_none=False, infer_frozen_os=False, record_detectors=False, max_length=None, overflow=None,
+           engine=None, frozen=False):
+    """
+    agent: str, or bytes/bytearray/memoryview of UTF-8 (see decode_agent)
     fill_none: if name/version is not detected respective key is still added to the result with value None
+    infer_frozen_os: for the frozen "Mac OS X 10.15.7" token add the probable real macOS range(s)
+        as result['flavor']['inferred']
+    record_detectors: list the ids of all detectors that matched as result['detectors']
+    max_length: agents longer than this are handled per overflow, MAX_AGENT_LENGTH by default, 0 for no limit
+    overflow: 'truncate' to detect on the first max_length characters, 'reject' to detect nothing,
+        AGENT_OVERFLOW by default
+    engine: 'reference' or 'two_phase' (same result, fewer getVersion/getModel calls),
+        detectorshub.engine by default
+    frozen: return an immutable FrozenDict shared by all equal results (see freeze_result)
+
+    Agents in detectorshub.exact_table (see DetectorsHub.load_exact_table) are
+    answered from it without running any detector, except with record_detectors.
     """
+    metrics = _metrics
+    if metrics is not None:
+        started = time.perf_counter()
     result = dict(platform=dict(name=None, version=None))
-    _suggested_detectors = []
+    matched = [] if record_detectors else None
 
-    for info_type in detectorshub:
-        detectors = _suggested_detectors or detectorshub[info_type]
-        for detector in detectors:
-            try:
-                detector.detect(agent, result)
-            except Exception as _err:
-                pass
+    agent = _bounded_agent(agent, max_length, overflow)
+
+    exact = detectorshub.exact_table
+    if exact is not None and matched is None and agent in exact:
+        result = exact[agent]
+        if not frozen or infer_frozen_os or fill_none:
+            result = dict((k, dict(v) if isinstance(v, dict) else v) for k, v in result.items())
+    else:
+        detectorshub.run(agent, result, engine, matched)
+
+    if record_detectors:
+        result['detectors'] = matched
+
+    if infer_frozen_os:
+        _infer_frozen_os(result)
 
     if fill_none:
         for outer_key in ('os', 'browser'):
@@ -1653,6 +2541,10 @@ def detect(agent, fill_none=False):
             for inner_key in ('name', 'version'):
                 outer_value.setdefault(inner_key, None)
 
+    if frozen:
+        result = freeze_result(result)
+    if metrics is not None:
+        metrics.observe(result, time.perf_counter() - started)
     return result
 
 
@@ -1671,6 +2563,16 @@ def simple_detect_tuple(agent, parsed_agent=None):
         (os_name, os_version, browser_name, browser_version)::Tuple(str)
     """
     result = parsed_agent or detect(agent)
+    if isinstance(result, FrozenDict):
+        try:
+            return result._simple_tuple
+        except AttributeError:
+            result._simple_tuple = _simple_detect_tuple(result)
+            return result._simple_tuple
+    return _simple_detect_tuple(result)
+
+
+def _simple_detect_tuple(result):
     os_list = []
     if 'flavor' in result:
         os_list.append(result['flavor']['name'])
@@ -1682,6 +2584,9 @@ def simple_detect_tuple(agent, parsed_agent=None):
     os = os_list and " ".join(os_list) or UNKNOWN_OS_NAME
     os_version = os_list and (result.get('flavor') and result['flavor'].get('version')) or \
         (result.get('dist') and result['dist'].get('version')) or (result.get('os') and result['os'].get('version')) or ""
+    inferred = result.get('flavor') and result['flavor'].get('inferred')
+    if inferred:
+        os_version = ';'.join((os_version, inferred))
     browser = 'browser' in result and result['browser'].get('name') or UNKNOWN_BROWSER_NAME
     browser_version = 'browser' in result and result['browser'].get('version') or ""
     model = 'model' in result and result['model'] or ""
@@ -1699,9 +2604,22 @@ def simple_detect(agent, parsed_agent=None):
     @return:
         (os_name_version, browser_name_version)::Tuple(str)
     """
-    os, os_version, browser, browser_version, model = simple_detect_tuple(agent, parsed_agent=parsed_agent)
+    if isinstance(parsed_agent, FrozenDict):
+        try:
+            return parsed_agent._simple
+        except AttributeError:
+            parsed_agent._simple = _simple_detect(simple_detect_tuple(agent, parsed_agent))
+            return parsed_agent._simple
+    return _simple_detect(simple_detect_tuple(agent, parsed_agent=parsed_agent))
+
+
+def _simple_detect(parts):
+    os, os_version, browser, browser_version, model = parts
     if browser_version:
         browser = " ".join((browser, browser_version))
     if os_version:
         os = " ".join((os, os_version))
     return os, browser, model
+
+
+from .clienthints import detect_headers  # noqa: E402
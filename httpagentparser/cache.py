@@ -0,0 +1,272 @@
+"""
+Result caches for detect().
+
+    * LRUCache        - bounded in-memory cache
+    * PersistentCache - sqlite3 backed cache shared across runs and processes
+    * CachedDetector  - detect()/detect_many() front end combining the two
+
+Persistent entries are namespaced by __version__ and the fingerprint of the
+registered detectors, so upgrading the library or registering a new detector
+never serves stale results.
+
+Agents may be given as str or as UTF-8 bytes/memoryview. Byte agents are
+looked up in the in-memory cache as they are and only decoded when parsed or
+when the persistent cache is consulted.
+"""
+
+import json
+import sqlite3
+from collections import OrderedDict
+
+import httpagentparser
+
+
+def default_namespace():
+    return '%s:%s' % (httpagentparser.__version__, httpagentparser.detectorshub.fingerprint())
+
+
+def copy_result(result):
+    """
+    => copy of a detect() result deep enough that callers may mutate it,
+    frozen results (httpagentparser.FrozenDict) included
+    """
+    if isinstance(result, httpagentparser.FrozenDict):
+        return httpagentparser.thaw_result(result)
+    return dict((k, v.copy() if isinstance(v, (dict, list)) else v) for k, v in result.items())
+
+
+def cache_key(agent):
+    """
+    => hashable in-memory cache key for agent
+    str, bytes and read-only byte memoryviews are used as they are: a memoryview
+    hashes and compares like the bytes it views, so lookups do not copy it.
+    """
+    if isinstance(agent, (str, bytes)):
+        return agent
+    if isinstance(agent, memoryview) and agent.readonly and agent.format in ('B', 'b', 'c'):
+        return agent
+    return bytes(agent)
+
+
+def _owned(key):
+    # do not keep the caller's buffer alive from the cache
+    return bytes(key) if isinstance(key, memoryview) else key
+
+
+class LRUCache(object):
+    def __init__(self, maxsize=10000):
+        self.maxsize = maxsize
+        self.data = OrderedDict()
+        self.hits = self.misses = self.evictions = 0
+
+    def get(self, key, default=None):
+        try:
+            value = self.data[key]
+        except KeyError:
+            self.misses += 1
+            return default
+        self.data.move_to_end(key)
+        self.hits += 1
+        return value
+
+    def set(self, key, value):
+        data = self.data
+        data[key] = value
+        data.move_to_end(key)
+        if len(data) > self.maxsize:
+            data.popitem(last=False)
+            self.evictions += 1
+
+    def __contains__(self, key):
+        return key in self.data
+
+    def __len__(self):
+        return len(self.data)
+
+    def clear(self):
+        self.data.clear()
+
+    def stats(self):
+        return dict(hits=self.hits, misses=self.misses, evictions=self.evictions, size=len(self.data))
+
+
+class PersistentCache(object):
+    """
+    path: sqlite3 database file, created if missing
+    namespace: defaults to __version__ + detectors fingerprint
+    batch_size: rows per SELECT/INSERT statement
+    """
+
+    def __init__(self, path, namespace=None, batch_size=500):
+        self.path = path
+        self.namespace = namespace or default_namespace()
+        self.batch_size = batch_size
+        self.conn = sqlite3.connect(path, timeout=30)
+        self.conn.execute('CREATE TABLE IF NOT EXISTS results ('
+                          'namespace TEXT NOT NULL, agent TEXT NOT NULL, result TEXT NOT NULL, '
+                          'PRIMARY KEY (namespace, agent)) WITHOUT ROWID')
+        self.conn.commit()
+
+    def _batches(self, items):
+        items = list(items)
+        for i in range(0, len(items), self.batch_size):
+            yield items[i:i + self.batch_size]
+
+    def get_many(self, agents):
+        """
+        => {agent: result} for the agents present in the cache
+        """
+        found = {}
+        for batch in self._batches(set(agents)):
+            query = 'SELECT agent, result FROM results WHERE namespace = ? AND agent IN (%s)' % \
+                ','.join('?' * len(batch))
+            for agent, result in self.conn.execute(query, [self.namespace] + batch):
+                found[agent] = json.loads(result)
+        return found
+
+    def set_many(self, items):
+        """
+        items: iterable of (agent, result)
+        """
+        for batch in self._batches(items):
+            with self.conn:
+                self.conn.executemany(
+                    'INSERT OR REPLACE INTO results (namespace, agent, result) VALUES (?, ?, ?)',
+                    [(self.namespace, agent, json.dumps(result, separators=(',', ':'))) for agent, result in batch])
+
+    def get(self, agent, default=None):
+        return self.get_many([agent]).get(agent, default)
+
+    def set(self, agent, result):
+        self.set_many([(agent, result)])
+
+    def items(self, limit=None):
+        query = 'SELECT agent, result FROM results WHERE namespace = ?'
+        args = [self.namespace]
+        if limit is not None:
+            query += ' LIMIT ?'
+            args.append(limit)
+        for agent, result in self.conn.execute(query, args):
+            yield agent, json.loads(result)
+
+    def __len__(self):
+        return self.conn.execute('SELECT COUNT(*) FROM results WHERE namespace = ?', [self.namespace]).fetchone()[0]
+
+    def purge(self):
+        """
+        Drop entries written by other library versions or detector sets.
+        """
+        with self.conn:
+            self.conn.execute('DELETE FROM results WHERE namespace != ?', [self.namespace])
+
+    def close(self):
+        self.conn.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+
+class CachedDetector(object):
+    """
+    detect() with an in-memory cache in front of an optional persistent one.
+
+    cache: in-memory cache (get/set), an LRUCache(maxsize) by default
+    store: PersistentCache shared across runs, optional
+    normalizer: callable canonicalizing str agents before lookup, e.g.
+        httpagentparser.normalize.normalize; byte agents are decoded first
+    frozen: cache and return shared read-only results (httpagentparser.FrozenDict)
+        instead of handing out a fresh copy on every call
+    """
+
+    def __init__(self, cache=None, store=None, maxsize=10000, normalizer=None, frozen=False):
+        self.cache = LRUCache(maxsize) if cache is None else cache
+        self.store = store
+        self.normalizer = normalizer
+        self.frozen = frozen
+        self.parsed = 0
+
+    def _normalized(self, agent):
+        if self.normalizer is None:
+            return agent
+        return self.normalizer(httpagentparser.decode_agent(agent))
+
+    def _parse(self, agent):
+        self.parsed += 1
+        return httpagentparser.detect(agent, frozen=self.frozen)
+
+    def _stored(self, result):
+        # applied to whatever a cache or store hands back: a SharedMemoryCache
+        # or PersistentCache returns plain dicts decoded from JSON
+        return httpagentparser.freeze_result(result) if self.frozen else result
+
+    def _result(self, result):
+        return result if self.frozen else copy_result(result)
+
+    def detect(self, agent):
+        agent = self._normalized(agent)
+        key = cache_key(agent)
+        result = self.cache.get(key)
+        if result is not None:
+            result = self._stored(result)
+        else:
+            if self.store is not None:
+                agent = httpagentparser.decode_agent(agent)
+                result = self.store.get(agent)
+                if result is not None:
+                    result = self._stored(result)
+            if result is None:
+                result = self._parse(agent)
+                if self.store is not None:
+                    self.store.set(agent, result)
+            self.cache.set(_owned(key), result)
+        return self._result(result)
+
+    def detect_many(self, agents):
+        """
+        => [result, ...] in the order of agents
+        Lookups and inserts against the store are batched, and every
+        distinct agent is parsed at most once.
+        """
+        keys = [cache_key(self._normalized(agent)) for agent in agents]
+        known = {}
+        missing = {}
+        for key in keys:
+            if key in known or key in missing:
+                continue
+            result = self.cache.get(key)
+            if result is None:
+                missing[key] = httpagentparser.decode_agent(key)
+            else:
+                known[key] = self._stored(result)
+        if missing and self.store is not None:
+            stored = self.store.get_many(missing.values())
+            for key, agent in list(missing.items()):
+                if agent in stored:
+                    known[key] = self._stored(stored[agent])
+                    del missing[key]
+        parsed = [(agent, self._parse(agent)) for agent in missing.values()]
+        if parsed and self.store is not None:
+            self.store.set_many(parsed)
+        known.update(zip(missing, (result for _, result in parsed)))
+        for key in known:
+            if key not in self.cache:
+                self.cache.set(_owned(key), known[key])
+        return [self._result(known[key]) for key in keys]
+
+    def warm(self, limit=None):
+        """
+        Pre-load the in-memory cache from the store.
+        => number of entries loaded
+        """
+        if self.store is None:
+            return 0
+        if limit is None:
+            limit = getattr(self.cache, 'maxsize', None)
+        loaded = 0
+        for agent, result in self.store.items(limit):
+            self.cache.set(agent, self._stored(result))
+            loaded += 1
+        return loaded
@@ -0,0 +1,226 @@
+"""
+User-Agent Client Hints (Sec-CH-UA*) support.
+
+Chromium browsers send structured Sec-CH-UA headers alongside an increasingly
+frozen User-Agent string. detect_headers() reads the hints first and only
+parses the User-Agent string for the fields the hints do not cover.
+"""
+
+import httpagentparser
+
+# brand => detector name used by detect(), most specific brands first
+BRANDS = (
+    ('Microsoft Edge', 'ChromiumEdge'),
+    ('Opera GX', 'OperaGX'),
+    ('Opera', 'Opera'),
+    ('YaBrowser', 'Yandex.Browser'),
+    ('Yandex', 'Yandex.Browser'),
+    ('DuckDuckGo', 'DuckDuckGo'),
+    ('Google Chrome', 'Chrome'),
+    ('Chromium', 'Chrome'),
+)
+
+# Sec-CH-UA-Platform => detector supplying name and platform
+PLATFORMS = {
+    'Windows': ('os', 'Windows'),
+    'macOS': ('flavor', 'MacOS'),
+    'Android': ('dist', 'Android'),
+    'Linux': ('os', 'Linux'),
+    'Chrome OS': ('os', 'ChromeOS'),
+    'Chromium OS': ('os', 'ChromeOS'),
+}
+
+# platforms that detect() also reports an os for
+PLATFORM_OS = {
+    'macOS': 'Macintosh',
+    'Android': 'Linux',
+}
+
+# Sec-CH-UA-Platform-Version "0.x" on Windows 7 - 8.1
+WINDOWS_LEGACY_VERSIONS = {1: '7 / Server 2008 R2', 2: '8 / Server 2012', 3: '8.1 / Server 2012 R2'}
+
+SYSTEM_KEYS = ('os', 'dist', 'flavor', 'platform')
+
+
+def normalize_headers(headers):
+    """
+    headers: mapping or (name, value) pairs; WSGI environ style HTTP_SEC_CH_UA keys work too
+    => {lower-case-header-name: value}
+    """
+    items = headers.items() if hasattr(headers, 'items') else headers
+    normalized = {}
+    for key, value in items:
+        key = key.lower().replace('_', '-')
+        if key.startswith('http-'):
+            key = key[5:]
+        normalized[key] = value
+    return normalized
+
+
+def _parse_string(value, i):
+    # sf-string starting at value[i] == '"' => (string, index after closing quote)
+    chars = []
+    i += 1
+    while i < len(value):
+        c = value[i]
+        if c == '\\' and i + 1 < len(value):
+            chars.append(value[i + 1])
+            i += 2
+            continue
+        if c == '"':
+            return ''.join(chars), i + 1
+        chars.append(c)
+        i += 1
+    return ''.join(chars), i
+
+
+def parse_item(value):
+    """
+    Bare item of a structured header: '"Windows"' => 'Windows', '?1' => True
+    """
+    value = (value or '').strip()
+    if value.startswith('"'):
+        return _parse_string(value, 0)[0]
+    if value in ('?0', '?1'):
+        return value == '?1'
+    return value
+
+
+def parse_list(value):
+    """
+    Structured header list of strings with parameters:
+    '"Chromium";v="124", "Google Chrome";v="124"' => [('Chromium', {'v': '124'}), ...]
+    """
+    items = []
+    value = value or ''
+    i, n = 0, len(value)
+    while i < n:
+        while i < n and value[i] in ' \t,':
+            i += 1
+        if i >= n:
+            break
+        if value[i] == '"':
+            item, i = _parse_string(value, i)
+        else:
+            start = i
+            while i < n and value[i] not in ';,':
+                i += 1
+            item = value[start:i].strip()
+        params = {}
+        while i < n and value[i] == ';':
+            i += 1
+            start = i
+            while i < n and value[i] not in '=;,':
+                i += 1
+            key = value[start:i].strip()
+            param = True
+            if i < n and value[i] == '=':
+                i += 1
+                if i < n and value[i] == '"':
+                    param, i = _parse_string(value, i)
+                else:
+                    start = i
+                    while i < n and value[i] not in ';,':
+                        i += 1
+                    param = value[start:i].strip()
+            params[key] = param
+        while i < n and value[i] != ',':
+            i += 1
+        items.append((item, params))
+    return items
+
+
+def browser_from_brands(brands):
+    """
+    brands: parse_list() of Sec-CH-UA or Sec-CH-UA-Full-Version-List
+    => (detector name, version) or None; GREASE brands are ignored
+    """
+    versions = dict((brand, params.get('v')) for brand, params in brands)
+    for brand, name in BRANDS:
+        if brand in versions:
+            return name, versions[brand]
+
+
+def _windows_version(platform_version):
+    major = httpagentparser.version_tuple(platform_version)[:2]
+    if not major:
+        return None
+    if major[0] >= 13:
+        return '11'
+    if major[0] >= 1:
+        return '10'
+    return WINDOWS_LEGACY_VERSIONS.get(major[1] if len(major) > 1 else None)
+
+
+def _detector(info_type, name):
+    for detector in httpagentparser.detectorshub.get(info_type, ()):
+        if detector.__class__.__name__ == name:
+            return detector
+
+
+def detect_hints(headers):
+    """
+    => detect() shaped result holding only what the client hints provide
+    """
+    result = {}
+    brands = parse_list(headers.get('sec-ch-ua-full-version-list')) or parse_list(headers.get('sec-ch-ua'))
+    browser = browser_from_brands(brands)
+    if browser:
+        name, version = browser
+        result['browser'] = dict(name=name)
+        if version:
+            result['browser']['version'] = version
+
+    platform = parse_item(headers.get('sec-ch-ua-platform'))
+    if platform in PLATFORMS:
+        info_type, class_name = PLATFORMS[platform]
+        detector = _detector(info_type, class_name)
+        if detector is not None:
+            version = parse_item(headers.get('sec-ch-ua-platform-version')) or None
+            if version and platform == 'Windows':
+                version = _windows_version(version)
+            result[info_type] = dict(name=detector.name)
+            if version:
+                result[info_type]['version'] = version
+            if platform in PLATFORM_OS:
+                result['os'] = dict(name=PLATFORM_OS[platform])
+            result['platform'] = dict(name=detector.platform, version=version)
+
+    model = parse_item(headers.get('sec-ch-ua-model'))
+    if model:
+        result['model'] = model
+    if result:
+        result['bot'] = False
+    return result
+
+
+def detect_headers(headers, fill_none=False, **kw):
+    """
+    detect() for a request's headers: Sec-CH-UA* client hints first, the
+    User-Agent header (parsed with detect(**kw)) only for missing fields.
+    Read are Sec-CH-UA, Sec-CH-UA-Full-Version-List, Sec-CH-UA-Platform,
+    Sec-CH-UA-Platform-Version and Sec-CH-UA-Model. Sec-CH-UA-Mobile is
+    ignored: detect() results have no field for it.
+
+    headers: mapping of header name => value, WSGI environ keys accepted
+    """
+    headers = normalize_headers(headers)
+    result = dict(platform=dict(name=None, version=None))
+    hints = detect_hints(headers)
+    result.update(hints)
+
+    agent = headers.get('user-agent')
+    if agent and ('browser' not in hints or 'platform' not in hints):
+        parsed = httpagentparser.detect(agent, **kw)
+        for key, value in parsed.items():
+            if key in SYSTEM_KEYS and 'platform' in hints:
+                continue
+            if key not in hints or key == 'bot':
+                result[key] = value
+
+    if fill_none:
+        for outer_key in ('os', 'browser'):
+            outer_value = result.setdefault(outer_key, dict())
+            for inner_key in ('name', 'version'):
+                outer_value.setdefault(inner_key, None)
+    return result
@@ -0,0 +1,208 @@
+"""
+Compiled predicates over detect() results, for scanning logs for a few rows.
+
+Lookups use Django-style field paths with an optional operator suffix:
+
+    >>> old_chrome = compile_filter(browser__name='Chrome', browser__version__major__lt=100,
+    ...                             os__name='Windows')
+    >>> other_bots = compile_filter(bot=True, browser__name__ne='GoogleBot')
+    >>> old_chrome('Mozilla/5.0 (Windows NT 10.0) ... Chrome/99.0.4844.51 Safari/537.36')
+    {'platform': ..., 'os': {'name': 'Windows', 'version': '10'}, 'browser': ...}
+
+Fields are the result keys (os, dist, flavor, browser, platform with their
+name and version; model; bot). Operators:
+
+    exact (default), ne, in       plain comparisons
+    lt, lte, gt, gte              versions compared as numeric tuples, see version_key()
+    major                         transform comparing the first version number only
+
+A name equality (or in) can only hold when a detector with that name
+matched, and bot=True only when a bot detector did, so their look_for tokens
+are pushed down to a substring pre-check: rows holding none of them are
+rejected without running detect(). Filters pickle, so they can be passed to
+scan.scan_file(where=...) and run in its worker processes.
+"""
+
+import re
+from functools import lru_cache
+
+import httpagentparser
+
+FIELDS = ('os', 'dist', 'flavor', 'browser', 'platform', 'model', 'bot')
+OPERATORS = ('exact', 'ne', 'in', 'lt', 'lte', 'gt', 'gte')
+_NUMBER = re.compile(r'\d+')
+_SEPARATORS = re.compile(r'[._]')
+
+
+@lru_cache(maxsize=4096)
+def version_key(version):
+    """
+    => tuple of the leading numbers of a version string, () if it has none
+    "100.0.4896.127" => (100, 0, 4896, 127), "10_15_7" => (10, 15, 7), "9.64b" => (9, 64)
+    Unlike httpagentparser.version_tuple() it splits on '_' too and keeps the
+    number a part starts with, so that "9.64b" compares above "9.6".
+    """
+    numbers = []
+    for part in _SEPARATORS.split(str(version)):
+        match = _NUMBER.match(part.strip())
+        if match is None:
+            break
+        numbers.append(int(match.group()))
+    return tuple(numbers)
+
+
+def _compare(op, value, expected):
+    if op == 'exact':
+        return value == expected
+    if op == 'ne':
+        return value != expected
+    if op == 'in':
+        return value in expected
+    if value is None or value == ():
+        return False
+    if op == 'lt':
+        return value < expected
+    if op == 'lte':
+        return value <= expected
+    if op == 'gt':
+        return value > expected
+    return value >= expected
+
+
+class Filter(object):
+    """
+    Predicate compiled by compile_filter().
+
+    filter(agent) => detect(agent, **kw) if the result matches, else None
+    """
+
+    def __init__(self, lookups, detect_kw=None):
+        self.lookups = tuple(lookups)  # (field path, transform or None, operator, expected value)
+        self.detect_kw = detect_kw or {}
+        self._compiled_for = None
+        self._tokens = None
+
+    def __getstate__(self):
+        # the token groups are rebuilt against the hub of the unpickling process
+        return dict(lookups=self.lookups, detect_kw=self.detect_kw)
+
+    def __setstate__(self, state):
+        self.__init__(state['lookups'], state['detect_kw'])
+
+    def tokens(self):
+        """
+        => [tokens, ...], every group must have one of its tokens in an agent
+        for the filter to match it; recomputed when detectors are registered
+        """
+        hub = httpagentparser.detectorshub
+        detectors = hub.detectors()
+        if self._compiled_for is not detectors:
+            index = hub.token_index()
+            groups = []
+            for path, transform, op, expected in self.lookups:
+                wanted = _pushdown(path, transform, op, expected)
+                if wanted is None:
+                    continue
+                tokens = set()
+                for i, detector in enumerate(detectors):
+                    if not wanted(detector):
+                        continue
+                    if i in index.always:
+                        tokens = None
+                        break
+                    tokens.update(httpagentparser._look_for_tokens(detector))
+                if tokens is not None:
+                    # no need to look for a token when a shorter one it contains is looked for
+                    tokens = sorted(tokens, key=len)
+                    groups.append([t for n, t in enumerate(tokens) if not any(s in t for s in tokens[:n])])
+            self._tokens = groups
+            self._compiled_for = detectors
+        return self._tokens
+
+    def may_match(self, agent):
+        """
+        => False if agent can not match whatever detect() returns for it
+        """
+        for group in self.tokens():
+            for token in group:
+                if token in agent:
+                    break
+            else:
+                return False
+        return True
+
+    def matches(self, result):
+        """
+        => True if the detect() result satisfies every lookup
+        """
+        for path, transform, op, expected in self.lookups:
+            value = result
+            for key in path:
+                value = value.get(key) if isinstance(value, dict) else None
+            if value is not None and (transform == 'major' or op in ('lt', 'lte', 'gt', 'gte')):
+                value = version_key(value)
+                if transform == 'major':
+                    value = value[:1]
+            if not _compare(op, value, expected):
+                return False
+        return True
+
+    def __call__(self, agent):
+        agent = httpagentparser.decode_agent(agent)
+        if not self.may_match(agent):
+            return None
+        result = httpagentparser.detect(agent, **self.detect_kw)
+        return result if self.matches(result) else None
+
+
+def _pushdown(path, transform, op, expected):
+    # => predicate on detectors one of which must match for the lookup to hold, None if there is none
+    if transform is not None or op not in ('exact', 'in'):
+        return None
+    names = expected if op == 'in' else (expected,)
+    if path == ('bot',):
+        return (lambda d: d.bot) if all(names) else None
+    if len(path) != 2 or path[1] != 'name' or None in names:
+        return None
+    if path[0] == 'platform':
+        return lambda d: d.platform in names
+    return lambda d: d.info_type == path[0] and d.name in names
+
+
+def _expected(transform, op, value):
+    if op == 'in':
+        return tuple(_expected(transform, 'exact', v) for v in value)
+    if transform == 'major':
+        return (int(value),)
+    if op in ('lt', 'lte', 'gt', 'gte'):
+        return value if isinstance(value, tuple) else version_key(value)
+    return value
+
+
+def compile_filter(detect_kw=None, **lookups):
+    """
+    => Filter matching the results satisfying every lookup
+    detect_kw: keyword arguments of the detect() calls, e.g. dict(infer_frozen_os=True)
+    """
+    compiled = []
+    for lookup, value in sorted(lookups.items()):
+        parts = lookup.split('__')
+        op = parts.pop() if len(parts) > 1 and parts[-1] in OPERATORS else 'exact'
+        transform = parts.pop() if len(parts) > 1 and parts[-1] == 'major' else None
+        if parts[0] not in FIELDS or len(parts) > 2 or len(parts) == 2 and parts[1] not in ('name', 'version'):
+            raise ValueError('unknown field in lookup %r' % lookup)
+        if transform is not None and parts[-1] != 'version':
+            raise ValueError('major only applies to versions, not %r' % lookup)
+        compiled.append((tuple(parts), transform, op, _expected(transform, op, value)))
+    return Filter(compiled, detect_kw)
+
+
+def filter_agents(agents, where):
+    """
+    => yields (agent, result) for the agents whose result matches where,
+    parsing only those passing its token pre-check
+    """
+    for agent in agents:
+        result = where(agent)
+        if result is not None:
+            yield agent, result
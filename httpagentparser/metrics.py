@@ -0,0 +1,156 @@
+"""
+Opt-in parser metrics in the Prometheus text exposition format.
+
+    >>> from httpagentparser import metrics
+    >>> metrics.enable()
+    >>> metrics.register_cache('ua', cached_detector.cache)
+    ...
+    >>> body = metrics.render()   # serve with content type metrics.CONTENT_TYPE
+
+Exported series:
+
+    httpagentparser_detect_calls_total            detect() calls
+    httpagentparser_detect_seconds                detect() latency histogram
+    httpagentparser_detect_unknown_total{field}   results simple_detect() reports as
+                                                  UNKNOWN_OS_NAME / UNKNOWN_BROWSER_NAME
+    httpagentparser_detect_bots_total             results with bot set
+    httpagentparser_detector_exceptions_total{detector,exception}
+                                                  exceptions swallowed by DetectorsHub.run
+    httpagentparser_cache_{hits,misses,evictions}_total{cache}, httpagentparser_cache_entries{cache}
+                                                  stats() of the registered caches
+
+Unknown and bot rates are the ratio of their counter to the calls counter.
+The NoModel error modelAt() raises for every matched detector without model
+markers is how those report "no model", and is not counted.
+"""
+
+import bisect
+import threading
+
+import httpagentparser
+
+CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+DEFAULT_BUCKETS = (0.00001, 0.000025, 0.00005, 0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.1)
+
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('\n', '\\n').replace('"', '\\"')
+
+
+def _labels(**labels):
+    if not labels:
+        return ''
+    return '{%s}' % ','.join('%s="%s"' % (k, _escape(v)) for k, v in sorted(labels.items()))
+
+
+def _number(value):
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class Metrics(object):
+    """
+    buckets: upper bounds in seconds of the latency histogram
+    """
+
+    def __init__(self, buckets=DEFAULT_BUCKETS):
+        self.buckets = tuple(sorted(buckets))
+        self._lock = threading.Lock()
+        self.caches = {}
+        self.reset()
+
+    def reset(self):
+        with self._lock:
+            self.calls = 0
+            self.seconds = 0.0
+            self.bucket_counts = [0] * (len(self.buckets) + 1)
+            self.unknown = dict(os=0, browser=0)
+            self.bots = 0
+            self.exceptions = {}
+
+    def observe(self, result, seconds):
+        """
+        Record one detect() call and its result.
+        """
+        unknown_os = not any((result.get(key) or {}).get('name') for key in ('flavor', 'dist', 'os'))
+        unknown_browser = not (result.get('browser') or {}).get('name')
+        with self._lock:
+            self.calls += 1
+            self.seconds += seconds
+            self.bucket_counts[bisect.bisect_left(self.buckets, seconds)] += 1
+            self.unknown['os'] += unknown_os
+            self.unknown['browser'] += unknown_browser
+            self.bots += bool(result.get('bot'))
+
+    def swallowed(self, detector, error):
+        if isinstance(error, httpagentparser.NoModel):
+            return
+        key = (detector.detector_id, type(error).__name__)
+        with self._lock:
+            self.exceptions[key] = self.exceptions.get(key, 0) + 1
+
+    def register_cache(self, name, cache):
+        """
+        cache: anything with a stats() => dict(hits, misses, evictions, size=entries held)
+        method, e.g. LRUCache or SharedMemoryCache
+        """
+        self.caches[name] = cache
+
+    def render(self):
+        """
+        => metrics in the Prometheus text format
+        """
+        lines = []
+
+        def metric(name, kind, help, samples):
+            lines.append('# HELP %s %s' % (name, help))
+            lines.append('# TYPE %s %s' % (name, kind))
+            for suffix, labels, value in samples:
+                lines.append('%s%s%s %s' % (name, suffix, _labels(**labels), _number(value)))
+
+        with self._lock:
+            cumulative, buckets = 0, []
+            for bound, count in zip(self.buckets + ('+Inf',), self.bucket_counts):
+                cumulative += count
+                buckets.append(('_bucket', dict(le=bound if bound == '+Inf' else repr(bound)), cumulative))
+            metric('httpagentparser_detect_calls_total', 'counter', 'detect() calls.', [('', {}, self.calls)])
+            metric('httpagentparser_detect_seconds', 'histogram', 'detect() latency in seconds.',
+                   buckets + [('_sum', {}, self.seconds), ('_count', {}, self.calls)])
+            metric('httpagentparser_detect_unknown_total', 'counter', 'Results without an OS or browser name.',
+                   [('', dict(field=field), count) for field, count in sorted(self.unknown.items())])
+            metric('httpagentparser_detect_bots_total', 'counter', 'Results detected as bots.',
+                   [('', {}, self.bots)])
+            metric('httpagentparser_detector_exceptions_total', 'counter', 'Detector exceptions swallowed.',
+                   [('', dict(detector=d, exception=e), n) for (d, e), n in sorted(self.exceptions.items())])
+
+        stats = [(name, cache.stats()) for name, cache in sorted(self.caches.items())]
+        for key in ('hits', 'misses', 'evictions'):
+            metric('httpagentparser_cache_%s_total' % key, 'counter', 'Result cache %s.' % key,
+                   [('', dict(cache=name), s.get(key, 0)) for name, s in stats])
+        metric('httpagentparser_cache_entries', 'gauge', 'Result cache size.',
+               [('', dict(cache=name), s.get('size', 0)) for name, s in stats])
+        return '\n'.join(lines) + '\n'
+
+
+def enable(metrics=None):
+    """
+    Start collecting detect() metrics.
+    => the collecting Metrics
+    """
+    httpagentparser._metrics = metrics or httpagentparser._metrics or Metrics()
+    return httpagentparser._metrics
+
+
+def disable():
+    httpagentparser._metrics = None
+
+
+def register_cache(name, cache):
+    enable().register_cache(name, cache)
+
+
+def render():
+    """
+    => Prometheus text for the enabled metrics, empty when not enabled
+    """
+    metrics = httpagentparser._metrics
+    return metrics.render() if metrics is not None else ''
@@ -0,0 +1,98 @@
+"""
+Conservative UA normalization to raise result cache hit rates.
+
+Many distinct agents parse to the same result and differ only in parts no
+detector reads. normalize() drops such parts so they share a cache entry:
+
+    * gzip     - the ",gzip(gfe)" suffix added by Google front ends
+    * language - locale tags like "; en-US" or "; fr-ch" inside a comment,
+                 except in agents where a detector reads up to the end of
+                 the string or comment (ChromeOS) or, as for Android, up to
+                 the following ";"
+    * dotnet   - "; .NET CLR 2.0.50727" / "; .NET4.0C" tokens of old IE
+
+Build IDs ("Build/FROYO") are kept on purpose: the Android model is read
+from the text before them and OperaNew parses after them.
+
+check_rules() runs every rule over a corpus and reports the agents whose
+detect() result a rule would change; tests.py keeps it empty for the bundled
+corpora. Use cardinality() to see what normalization buys on your logs:
+
+    >>> cached = CachedDetector(normalizer=normalize)
+    >>> cardinality(line.strip() for line in open('agents.log'))
+    {'raw': 48213, 'normalized': 30170, 'reduction': 0.374...}
+"""
+
+import re
+
+import httpagentparser
+
+
+class Rule(object):
+    """
+    pattern: regex of the parts to drop
+    unless: the rule is not applied to agents containing any of these
+    """
+
+    def __init__(self, name, pattern, unless=()):
+        self.name = name
+        self.pattern = re.compile(pattern)
+        self.unless = unless
+
+    def __call__(self, agent):
+        for word in self.unless:
+            if word in agent:
+                return agent
+        return self.pattern.sub('', agent)
+
+
+RULES = (
+    Rule('gzip', r',\s*gzip\(gfe\)'),
+    # only the "; en-US" slot of a parenthesized comment, where no version
+    # read up to the next space or ";" can end; not where a detector reads
+    # a version up to the end of the agent or, as ChromeOS, of the comment
+    Rule('language', r';\s+[a-z]{2}(?:[-_][A-Za-z]{2})?(?=\s*[;)][^()]*\))',
+         unless=('Android', 'CrOS', 'CPU OS ', 'iPadOS ', 'iPhone/iOS ', 'Darwin/', 'python', 'Java', 'axios')),
+    Rule('dotnet', r';\s*\.NET(?: CLR [\d.]+|[\d.]+[A-Z]?)(?=\s*[;)]|$)'),
+)
+
+
+class Normalizer(object):
+    def __init__(self, rules=RULES):
+        self.rules = rules
+
+    def __call__(self, agent):
+        for rule in self.rules:
+            agent = rule(agent)
+        return agent
+
+
+normalize = Normalizer()
+
+
+def cardinality(agents, normalizer=normalize):
+    """
+    => dict(raw=distinct agents, normalized=distinct normalized agents, reduction=fraction saved)
+    """
+    raw = set(agents)
+    normalized = set(normalizer(agent) for agent in raw)
+    return dict(raw=len(raw), normalized=len(normalized),
+                reduction=1 - len(normalized) / len(raw) if raw else 0.0)
+
+
+def check_rules(agents, rules=RULES):
+    """
+    => {rule name: [agents whose detect() result the rule changes]}, empty lists when safe
+    """
+    broken = dict((rule.name, []) for rule in rules)
+    for agent in set(agents):
+        expected = None
+        for rule in rules:
+            normalized = rule(agent)
+            if normalized == agent:
+                continue
+            if expected is None:
+                expected = httpagentparser.detect(agent)
+            if httpagentparser.detect(normalized) != expected:
+                broken[rule.name].append(agent)
+    return broken
@@ -0,0 +1,79 @@
+"""
+Incremental reclassification of stored results after a library upgrade.
+
+Before upgrading, save the fingerprints of the registered detectors and store
+results parsed with detect(agent, record_detectors=True). After upgrading, a
+Reclassifier built from the saved fingerprints re-parses only the rows that a
+changed, added or removed detector could affect:
+
+    >>> save_fingerprints('fingerprints.json')        # old version
+    >>> reclassifier = Reclassifier(load_fingerprints('fingerprints.json'))
+    >>> for agent, result in reclassifier.reclassify(rows):  # rows of (agent, detectors)
+    ...     store(agent, result)
+"""
+
+import json
+
+import httpagentparser
+
+
+def save_fingerprints(path, hub=None):
+    hub = hub or httpagentparser.detectorshub
+    with open(path, 'w') as f:
+        json.dump(dict(version=httpagentparser.__version__, detectors=hub.fingerprints()), f, indent=1)
+
+
+def load_fingerprints(path):
+    with open(path) as f:
+        return [tuple(item) for item in json.load(f)['detectors']]
+
+
+def changed_detectors(old, new):
+    """
+    old, new: [(detector_id, fingerprint), ...] as returned by DetectorsHub.fingerprints()
+    => (ids of changed, added or removed detectors, True if the order of the kept ones changed)
+    """
+    old_fps, new_fps = dict(old), dict(new)
+    changed = set(old_fps) ^ set(new_fps)
+    changed.update(i for i in old_fps if i in new_fps and old_fps[i] != new_fps[i])
+    kept_old = [i for i, _ in old if i in new_fps]
+    kept_new = [i for i, _ in new if i in old_fps]
+    return changed, kept_old != kept_new
+
+
+class Reclassifier(object):
+    """
+    old_fingerprints: DetectorsHub.fingerprints() of the version that produced the stored results
+    """
+
+    def __init__(self, old_fingerprints, hub=None):
+        self.hub = hub or httpagentparser.detectorshub
+        self.changed, self.reordered = changed_detectors(old_fingerprints, self.hub.fingerprints())
+        # new or changed detectors may now match rows they did not match before
+        self.probes = [d for typ in self.hub for d in self.hub[typ] if d.detector_id in self.changed]
+        self.checked = self.reparsed = 0
+
+    def needs_reparse(self, agent, detectors):
+        """
+        detectors: result['detectors'] recorded for agent, None if unknown
+        """
+        if self.reordered or detectors is None or self.changed.intersection(detectors):
+            return True
+        for detector in self.probes:
+            try:
+                if detector.checkWords(agent):
+                    return True
+            except Exception:
+                return True
+        return False
+
+    def reclassify(self, rows):
+        """
+        rows: iterable of (agent, recorded detectors)
+        => yields (agent, new result) for the rows that need it
+        """
+        for agent, detectors in rows:
+            self.checked += 1
+            if self.needs_reparse(agent, detectors):
+                self.reparsed += 1
+                yield agent, httpagentparser.detect(agent, record_detectors=True)
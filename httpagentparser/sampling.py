@@ -0,0 +1,172 @@
+"""
+Deterministic sampling in front of detect() for very high volume streams.
+
+A request is parsed only when a stable hash of its sampling key falls under
+rate * 2**64, so parser CPU is capped at that fraction of the traffic. The key
+is either the UA itself or a per-request key such as a request ID:
+
+    * by='agent'   - a UA is either always or never sampled, on every node
+                     sharing the salt, so per-family results stay consistent
+                     across nodes and repeated UAs hit caches downstream
+    * by='request' - requests are sampled independently of their UA, which
+                     gives tighter intervals for families made of few UAs
+
+SampledCounter scales the sampled counts back up (Horvitz-Thompson) and
+reports normal approximation confidence intervals:
+
+    >>> counter = SampledCounter(rate=0.01)
+    >>> for agent in stream:
+    ...     counter.add(agent)
+    >>> counter.estimate('Chrome')
+    (1234500.0, 1190321.7, 1278678.3)
+"""
+
+import math
+from collections import Counter
+from statistics import NormalDist
+
+import httpagentparser
+from .sketches import browser_family, hash64
+
+
+class HashSampler(object):
+    """
+    rate: fraction of keys selected, 0 < rate <= 1
+    salt: bytes choosing the sample; nodes sharing it select the same keys
+    """
+
+    def __init__(self, rate, salt=b''):
+        if not 0 < rate <= 1:
+            raise ValueError('rate must be in (0, 1]')
+        self.rate = rate
+        self.salt = salt
+        self.threshold = int(rate * (1 << 64))
+
+    def selected(self, key):
+        return hash64(key, self.salt) < self.threshold
+
+    def detect(self, agent, key=None, **kw):
+        """
+        key: sampling key, agent by default
+        => detect(agent, **kw) if selected, None otherwise
+        """
+        if self.selected(agent if key is None else key):
+            return httpagentparser.detect(agent, **kw)
+
+
+class SampledCounter(object):
+    """
+    Estimated request counts per key from a hash sampled stream.
+
+    rate, salt: see HashSampler
+    by: 'agent' or 'request', what add() hashes to decide
+    key: callable mapping a detect() result to the key counted, browser name by default
+    max_agents: with by='agent', UAs whose request counts are kept for the variance.
+        Past it the least requested tenth is dropped, Space-Saving style: a UA
+        seen again restarts from the largest dropped count, an upper bound of
+        its true one, so intervals only get wider; the counts stay exact.
+    """
+
+    def __init__(self, rate, by='agent', key=browser_family, salt=b'', max_agents=100000):
+        if by not in ('agent', 'request'):
+            raise ValueError("by must be 'agent' or 'request', not %r" % by)
+        self.sampler = HashSampler(rate, salt)
+        self.by = by
+        self.key = key
+        self.seen = 0
+        self.counts = Counter()
+        # sums of squared sampling unit sizes per key, for the variance; with
+        # by='agent' a unit is every request of one UA, else a single request
+        self.squares = Counter()
+        self.agents = {}  # by='agent': hash64(agent) => [key, requests]
+        self.max_agents = max_agents
+        self.floor = 0  # bound of the requests of any UA not in agents
+
+    @property
+    def rate(self):
+        return self.sampler.rate
+
+    @property
+    def sampled(self):
+        return sum(self.counts.values())
+
+    def _count(self, key, agent_hash, n):
+        self.counts[key] += n
+        if agent_hash is None:
+            self.squares[key] += n
+            return
+        unit = self.agents.get(agent_hash)
+        if unit is None:
+            unit = self.agents[agent_hash] = [key, self.floor]
+            if len(self.agents) > self.max_agents:
+                self._evict()
+        self.squares[unit[0]] += 2 * unit[1] * n + n * n
+        unit[1] += n
+
+    def _evict(self):
+        units = sorted(self.agents.items(), key=lambda item: item[1][1])
+        for agent_hash, (_, n) in units[:len(units) - self.max_agents * 9 // 10]:
+            del self.agents[agent_hash]
+            self.floor = max(self.floor, n)
+
+    def add(self, agent, request_key=None, result=None):
+        """
+        request_key: required with by='request'
+        result: detect() output for agent, parsed here when sampled and not supplied
+        => detect() result when the request is sampled, None otherwise
+        """
+        self.seen += 1
+        if self.by == 'request':
+            if request_key is None:
+                raise ValueError("request_key is required when sampling by='request'")
+            if not self.sampler.selected(request_key):
+                return None
+        elif not self.sampler.selected(agent):
+            return None
+        if result is None:
+            result = httpagentparser.detect(agent)
+        self._count(self.key(result), hash64(agent) if self.by == 'agent' else None, 1)
+        return result
+
+    def estimate(self, key, confidence=0.95):
+        """
+        => (estimated requests, lower bound, upper bound) for key
+        """
+        p = self.rate
+        estimate = self.counts[key] / p
+        spread = NormalDist().inv_cdf((1 + confidence) / 2) * math.sqrt((1 - p) * self.squares[key]) / p
+        return estimate, max(estimate - spread, 0.0), estimate + spread
+
+    def estimates(self, confidence=0.95):
+        """
+        => {key: (estimate, lower bound, upper bound)} for every key sampled so far
+        """
+        return dict((key, self.estimate(key, confidence)) for key in self.counts)
+
+    def merge(self, other):
+        """
+        Add the samples of another counter sampling the same way, e.g. from another node.
+        """
+        if (other.rate, other.sampler.salt, other.by) != (self.rate, self.sampler.salt, self.by):
+            raise ValueError('can only merge counters with the same rate, salt and by')
+        self.seen += other.seen
+        if self.by == 'agent':
+            # a UA's unit is the sum of its requests on both sides, so the squares
+            # gain twice the products; UAs one side no longer tracks count at its floor
+            cross = Counter()
+            if other.floor:
+                for key, n in self.counts.items():
+                    cross[key] += other.floor * n
+            for agent_hash, (key, n) in other.agents.items():
+                unit = self.agents.get(agent_hash)
+                if unit is None:
+                    unit = self.agents[agent_hash] = [key, self.floor]
+                cross[key] += unit[1] * n
+                unit[1] += n
+            for key, n in cross.items():
+                self.squares[key] += 2 * n
+            self.floor += other.floor
+            if len(self.agents) > self.max_agents:
+                self._evict()
+        self.counts.update(other.counts)
+        self.squares.update(other.squares)
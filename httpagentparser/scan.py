@@ -0,0 +1,125 @@
+"""
+Parallel simple_detect() over large files of User-Agent strings, one per line.
+
+The file is mmap'd and split into byte ranges ending on a newline. Each range
+is parsed by a worker process straight from the mapping, with repeated lines
+parsed once per range, so the file is never read into Python strings up front:
+
+    >>> for agent, (os, browser, model) in scan_file('agents.log', infer_frozen_os=True):
+    ...     print(agent, os, browser)
+    >>> count_file('agents.log').most_common(10)
+
+With where=filters.compile_filter(...) only the matching lines are yielded
+or counted, and lines failing its token pre-check are never parsed. Lines
+are matched on detect() with the filter's detect_kw, as where(agent) does.
+"""
+
+import mmap
+import os
+from collections import Counter, deque
+from concurrent.futures import ProcessPoolExecutor
+
+import httpagentparser
+
+CHUNK_SIZE = 8 * 1024 * 1024
+
+
+def split_ranges(path, chunk_size=CHUNK_SIZE):
+    """
+    => [(start, end), ...] byte ranges of about chunk_size covering the file,
+    each ending just after a newline (or at the end of the file)
+    """
+    with open(path, 'rb') as f:
+        size = os.fstat(f.fileno()).st_size
+        if not size:
+            return []
+        with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+            ranges = []
+            start = 0
+            while start < size:
+                end = start + chunk_size
+                if end >= size:
+                    end = size
+                else:
+                    newline = mm.find(b'\n', end - 1)
+                    end = size if newline < 0 else newline + 1
+                ranges.append((start, end))
+                start = end
+            return ranges
+
+
+def _parse_range(path, start, end, min_length, kw, where=None):
+    # => [(agent, simple_detect result), ...] for the lines in [start, end)
+    parsed = []
+    seen = {}
+    with open(path, 'rb') as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+        pos = start
+        while pos < end:
+            newline = mm.find(b'\n', pos, end)
+            stop = end if newline < 0 else newline
+            line = mm[pos:stop]
+            pos = stop + 1
+            try:
+                hit = seen[line]
+            except KeyError:
+                agent = httpagentparser.decode_agent(line).strip()
+                hit = None
+                if len(agent) >= min_length and (where is None or where.may_match(agent)):
+                    result = httpagentparser.detect(agent, **kw)
+                    if where is None or where.matches(result if where.detect_kw == kw else
+                                                      httpagentparser.detect(agent, **where.detect_kw)):
+                        hit = agent, httpagentparser.simple_detect(agent, parsed_agent=result)
+                seen[line] = hit
+            if hit is not None:
+                parsed.append(hit)
+    return parsed
+
+
+def _count_range(path, start, end, min_length, kw, where=None):
+    return Counter(result for _, result in _parse_range(path, start, end, min_length, kw, where))
+
+
+def _map(func, path, workers, chunk_size, min_length, kw, where):
+    ranges = split_ranges(path, chunk_size)
+    args = [(path, start, end, min_length, kw, where) for start, end in ranges]
+    if workers == 1 or len(ranges) < 2:
+        for arg in args:
+            yield func(*arg)
+        return
+    # pool.map would submit every range at once and pile the results up here
+    # while the caller is slow; keep a couple of ranges per worker in flight
+    window = 2 * (workers or os.cpu_count() or 1)
+    pending = deque()
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        for arg in args:
+            if len(pending) >= window:
+                yield pending.popleft().result()
+            pending.append(pool.submit(func, *arg))
+        while pending:
+            yield pending.popleft().result()
+
+
+def scan_file(path, workers=None, chunk_size=CHUNK_SIZE, min_length=1, where=None, **kw):
+    """
+    => yields (agent, (os, browser, model)) for every line in file order
+
+    workers: worker processes, os.cpu_count() by default, 1 to parse in this process
+    chunk_size: approximate bytes per work item
+    min_length: stripped lines shorter than this are skipped
+    where: filters.Filter, only lines whose result it matches are yielded
+    kw: passed on to detect(), e.g. infer_frozen_os=True
+    """
+    for chunk in _map(_parse_range, path, workers, chunk_size, min_length, kw, where):
+        for item in chunk:
+            yield item
+
+
+def count_file(path, workers=None, chunk_size=CHUNK_SIZE, min_length=1, where=None, **kw):
+    """
+    => Counter of (os, browser, model) over the lines of the file; only the
+    per-range counts travel back from the workers
+    """
+    counts = Counter()
+    for chunk in _map(_count_range, path, workers, chunk_size, min_length, kw, where):
+        counts.update(chunk)
+    return counts
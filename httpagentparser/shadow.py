@@ -0,0 +1,140 @@
+"""
+Shadow mode: prove a faster parsing path returns what the reference does.
+
+Shadow.detect() always returns the reference result. A hash sampled share of
+the calls also goes through the candidate, and differing results are kept
+with the agent. Both are timed on those calls for the speed ratio:
+
+    >>> shadow = Shadow('two_phase', rate=0.01)
+    >>> result = shadow.detect(agent)       # in place of httpagentparser.detect(agent)
+    >>> shadow.report()
+    {'calls': 120000, 'sampled': 1187, 'mismatches': 0, 'speedup': 2.71, ...}
+
+The reference is the plain detector loop of DetectorsHub: every detector,
+the reference engine, and no prefilter, dispatch, negative cache or exact
+table. replay() runs a whole corpus file through both offline and writes the
+report as JSON:
+
+    python -m httpagentparser.shadow agents.log report.json [engine]
+"""
+
+import json
+import sys
+import threading
+import time
+
+import httpagentparser
+from .cache import copy_result
+from .sampling import HashSampler
+
+
+def reference_detect(agent, max_length=None, overflow=None):
+    """
+    => detect(agent) computed by running every detector in order, on the
+    agent detect() would run them on (see its max_length and overflow)
+    """
+    agent = httpagentparser._bounded_agent(agent, max_length, overflow)
+    result = dict(platform=dict(name=None, version=None))
+    hub = httpagentparser.detectorshub
+    hub._run_reference(agent, result, hub.detectors(), None)
+    return result
+
+
+def _candidate(engine):
+    if callable(engine):
+        return engine
+    if engine not in httpagentparser.ENGINES:
+        raise ValueError('unknown engine %r' % engine)
+    return lambda agent: httpagentparser.detect(agent, engine=engine)
+
+
+class Shadow(object):
+    """
+    candidate: engine name for detect(engine=...), or callable agent => result,
+        e.g. a cache.CachedDetector().detect
+    rate: share of calls also run through the candidate, sampled by agent
+    reference: callable agent => the result returned, reference_detect by default
+    max_mismatches: mismatches kept for report(), all are counted
+    """
+
+    def __init__(self, candidate='two_phase', rate=0.01, reference=reference_detect, max_mismatches=100, salt=b''):
+        self.candidate = _candidate(candidate)
+        self.reference = reference
+        self.sampler = HashSampler(rate, salt)
+        self.max_mismatches = max_mismatches
+        self._lock = threading.Lock()
+        self.reset()
+        # do not bill the lazily built hub tables to the first sampled call
+        httpagentparser.detectorshub.compile()
+
+    def reset(self):
+        with self._lock:
+            self.calls = self.sampled = self.mismatch_count = 0
+            self.reference_seconds = self.candidate_seconds = 0.0
+            self.mismatches = []
+
+    def detect(self, agent):
+        """
+        => reference(agent); the candidate's result or exception never leaks out
+        """
+        if not self.sampler.selected(agent):
+            with self._lock:
+                self.calls += 1
+            return self.reference(agent)
+        started = time.perf_counter()
+        expected = self.reference(agent)
+        middle = time.perf_counter()
+        try:
+            actual = self.candidate(agent)
+        except Exception as err:
+            actual = '%s: %s' % (type(err).__name__, err)
+        taken = time.perf_counter() - middle
+        with self._lock:
+            self.calls += 1
+            self.sampled += 1
+            self.reference_seconds += middle - started
+            self.candidate_seconds += taken
+            if actual != expected:
+                self.mismatch_count += 1
+                if len(self.mismatches) < self.max_mismatches:
+                    agent = httpagentparser.decode_agent(agent)
+                    self.mismatches.append(dict(agent=agent, expected=copy_result(expected), actual=actual))
+        return expected
+
+    def report(self):
+        """
+        => dict(calls, sampled, mismatches, reference_seconds, candidate_seconds,
+        speedup=reference time / candidate time on the sampled calls, examples)
+        """
+        with self._lock:
+            return dict(calls=self.calls, sampled=self.sampled, mismatches=self.mismatch_count,
+                        reference_seconds=self.reference_seconds, candidate_seconds=self.candidate_seconds,
+                        speedup=self.reference_seconds / self.candidate_seconds if self.candidate_seconds else None,
+                        examples=list(self.mismatches))
+
+
+def replay(path, candidate='two_phase', report=None, max_mismatches=1000):
+    """
+    Run every non empty line of a corpus file through the reference and the candidate.
+    report: file to write report() to as JSON
+    => report()
+    """
+    shadow = Shadow(candidate, rate=1, max_mismatches=max_mismatches)
+    with open(path, 'rb') as f:
+        for line in f:
+            agent = httpagentparser.decode_agent(line).strip()
+            if agent:
+                shadow.detect(agent)
+    summary = shadow.report()
+    if report is not None:
+        with open(report, 'w', encoding='utf-8') as f:
+            json.dump(summary, f, indent=2, sort_keys=True, ensure_ascii=False)
+    return summary
+
+
+if __name__ == '__main__':
+    if len(sys.argv) not in (3, 4):
+        sys.exit('usage: python -m httpagentparser.shadow CORPUS REPORT [ENGINE]')
+    summary = replay(sys.argv[1], *sys.argv[3:], report=sys.argv[2])
+    print('%d agents, %d mismatches, speedup %.2f' % (summary['sampled'], summary['mismatches'], summary['speedup'] or 0))
+    sys.exit(1 if summary['mismatches'] else 0)
@@ -0,0 +1,213 @@
+"""
+Host wide detect() result cache for prefork servers.
+
+SharedMemoryCache is a fixed size, open addressed hash table living in an
+mmap'd file (under /dev/shm when available). Every worker process on the host
+maps the same file, so the table is paid for once per host and survives worker
+restarts warm.
+
+Layout: a 64 byte header followed by `slots` slots of `slot_size` bytes:
+
+    seq (u32) | key (16 byte blake2b of the UA) | length (u16) | JSON payload
+
+Readers are lock-free: a slot is only trusted when its sequence number is even
+and unchanged across the read (a seqlock). Writers take one of `stripes`
+fcntl byte range locks chosen by slot index, bump seq to odd, write, and bump
+it back to even.
+
+A file is never truncated or resized once created, since other processes may
+have it mapped and would die with SIGBUS. A file with another geometry or
+namespace is replaced by renaming a fresh one over its path; processes still
+mapping the old one keep using it until they reopen.
+"""
+
+import hashlib
+import json
+import mmap
+import os
+import struct
+import tempfile
+import threading
+
+try:
+    import fcntl
+except ImportError:  # not POSIX: writers are only serialized within a process
+    fcntl = None
+
+from .cache import default_namespace
+
+MAGIC = b'HAPSHM01'
+HEADER = struct.Struct('<8sQII')
+HEADER_SIZE = 64
+SLOT_HEAD = struct.Struct('<I16sH')
+EMPTY_KEY = b'\0' * 16
+
+
+def _key(agent):
+    # bytes, bytearray and memoryview agents are hashed without a copy
+    if isinstance(agent, str):
+        agent = agent.encode('utf-8', 'surrogatepass')
+    return hashlib.blake2b(agent, digest_size=16).digest()
+
+
+def default_path(namespace, slots=65536, slot_size=512):
+    base = '/dev/shm' if os.path.isdir('/dev/shm') else tempfile.gettempdir()
+    tag = hashlib.blake2b(namespace.encode('utf-8'), digest_size=8).hexdigest()
+    return os.path.join(base, 'httpagentparser-%s-%dx%d.cache' % (tag, slots, slot_size))
+
+
+class SharedMemoryCache(object):
+    """
+    Drop-in cache for CachedDetector(cache=...) shared by processes.
+
+    path: backing file, derived from namespace and geometry when omitted
+    slots: number of table slots
+    slot_size: bytes per slot; results that do not fit are not cached
+    probes: slots inspected per lookup (linear probing)
+    stripes: number of writer locks
+    """
+
+    def __init__(self, path=None, slots=65536, slot_size=512, probes=4, stripes=64, namespace=None):
+        namespace = namespace or default_namespace()
+        self.path = path or default_path(namespace, slots, slot_size)
+        self.slots = slots
+        self.slot_size = slot_size
+        self.capacity = slot_size - SLOT_HEAD.size
+        self.probes = probes
+        self.stripes = stripes
+        self.size = HEADER_SIZE + slots * slot_size
+        self.hits = self.misses = self.evictions = 0
+        self._lock = threading.Lock()
+        self._tag = struct.unpack('<Q', hashlib.blake2b(namespace.encode('utf-8'), digest_size=8).digest())[0]
+        self.fd = self._open_file()
+        self.mm = mmap.mmap(self.fd, self.size)
+
+    def _lock_range(self, start):
+        if fcntl is not None:
+            fcntl.lockf(self.fd, fcntl.LOCK_EX, 1, start)
+
+    def _unlock_range(self, start):
+        if fcntl is not None:
+            fcntl.lockf(self.fd, fcntl.LOCK_UN, 1, start)
+
+    def _open_file(self):
+        # => fd of a file at self.path holding our header; byte 0 serializes the
+        # openers whatever their geometry, the writer stripes lie past the table
+        expected = HEADER.pack(MAGIC, self._tag, self.slots, self.slot_size)
+        while True:
+            fd = os.open(self.path, os.O_RDWR | os.O_CREAT, 0o644)
+            if fcntl is not None:
+                fcntl.lockf(fd, fcntl.LOCK_EX, 1, 0)
+            try:
+                stat = os.fstat(fd)
+                if stat.st_ino != os.stat(self.path).st_ino:
+                    os.close(fd)  # replaced while we waited for the lock
+                    continue
+                if stat.st_size == self.size and os.pread(fd, HEADER.size, 0) == expected:
+                    return fd
+                if stat.st_size == 0:
+                    os.ftruncate(fd, self.size)
+                    os.pwrite(fd, expected, 0)
+                    return fd
+                self._replace_file(expected)
+            finally:
+                if fcntl is not None:
+                    fcntl.lockf(fd, fcntl.LOCK_UN, 1, 0)
+            os.close(fd)
+
+    def _replace_file(self, header):
+        # other geometry or stale namespace: rename an empty table over the path
+        fd, tmp = tempfile.mkstemp(dir=os.path.dirname(os.path.abspath(self.path)), suffix='.tmp')
+        try:
+            os.fchmod(fd, 0o644)
+            os.ftruncate(fd, self.size)
+            os.pwrite(fd, header, 0)
+        finally:
+            os.close(fd)
+        os.replace(tmp, self.path)
+
+    def _offsets(self, key):
+        home = int.from_bytes(key[:8], 'little') % self.slots
+        for i in range(self.probes):
+            yield HEADER_SIZE + ((home + i) % self.slots) * self.slot_size
+
+    def _read(self, offset, key):
+        mm = self.mm
+        seq, slot_key, length = SLOT_HEAD.unpack_from(mm, offset)
+        if seq & 1 or slot_key != key:
+            return slot_key, None
+        start = offset + SLOT_HEAD.size
+        payload = mm[start:start + length]
+        if SLOT_HEAD.unpack_from(mm, offset)[0] != seq:
+            return slot_key, None
+        return slot_key, payload
+
+    def get(self, agent, default=None):
+        key = _key(agent)
+        for offset in self._offsets(key):
+            slot_key, payload = self._read(offset, key)
+            if payload is not None:
+                try:
+                    value = json.loads(payload.decode('utf-8'))
+                except ValueError:  # torn write observed despite the seqlock
+                    break
+                self.hits += 1
+                return value
+            if slot_key == EMPTY_KEY:
+                break
+        self.misses += 1
+        return default
+
+    def set(self, agent, result):
+        payload = json.dumps(result, separators=(',', ':')).encode('utf-8')
+        if len(payload) > self.capacity:
+            return False
+        key = _key(agent)
+        offsets = list(self._offsets(key))
+        target = offsets[0]
+        for offset in offsets:
+            slot_key = self.mm[offset + 4:offset + 20]
+            if slot_key == key or slot_key == EMPTY_KEY:
+                target = offset
+                break
+        else:
+            self.evictions += 1
+        stripe = self.size + ((target - HEADER_SIZE) // self.slot_size) % self.stripes
+        with self._lock:
+            self._lock_range(stripe)
+            try:
+                mm = self.mm
+                seq = SLOT_HEAD.unpack_from(mm, target)[0] | 1
+                struct.pack_into('<I', mm, target, seq)
+                SLOT_HEAD.pack_into(mm, target, seq, key, len(payload))
+                start = target + SLOT_HEAD.size
+                mm[start:start + len(payload)] = payload
+                struct.pack_into('<I', mm, target, (seq + 1) & 0xffffffff)
+            finally:
+                self._unlock_range(stripe)
+        return True
+
+    def __contains__(self, agent):
+        key = _key(agent)
+        return any(self._read(offset, key)[1] is not None for offset in self._offsets(key))
+
+    def clear(self):
+        with self._lock:
+            self._lock_range(self.size + self.stripes)
+            try:
+                self.mm[HEADER_SIZE:] = b'\0' * (self.size - HEADER_SIZE)
+            finally:
+                self._unlock_range(self.size + self.stripes)
+
+    def __len__(self):
+        # occupied slots, written by any process; one pass over the slot keys
+        mm = self.mm
+        return sum(1 for offset in range(HEADER_SIZE + 4, self.size, self.slot_size)
+                   if mm[offset:offset + 16] != EMPTY_KEY)
+
+    def stats(self):
+        return dict(hits=self.hits, misses=self.misses, evictions=self.evictions, size=len(self), slots=self.slots)
+
+    def close(self):
+        self.mm.close()
+        os.close(self.fd)
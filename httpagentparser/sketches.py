@@ -0,0 +1,275 @@
+"""
+Fixed memory stream summaries for user agent traffic.
+
+Exact per UA tables grow without bound when clients randomize their agent
+strings. The sketches below trade a small, documented error for constant
+memory:
+
+    * HyperLogLog    - distinct counts (distinct UAs, distinct families)
+    * CountMinSketch - per key frequencies (hits per browser family)
+    * SpaceSaving    - top-K heavy hitters (most frequent raw UAs)
+    * BloomFilter    - set membership (UAs known to match no detector)
+
+UAStreamStats wires all three on top of detect().
+"""
+
+import hashlib
+import heapq
+import math
+
+import httpagentparser
+
+
+def _digest(item, size=8, salt=b''):
+    if not isinstance(item, (bytes, bytearray, memoryview)):
+        item = str(item).encode('utf-8', 'surrogatepass')
+    return hashlib.blake2b(item, digest_size=size, key=salt).digest()
+
+
+def hash64(item, salt=b''):
+    """
+    => stable 64 bit hash of a str/bytes value
+    salt: up to 64 bytes selecting an independent hash function
+
+    Unlike hash() the value does not change between processes or hosts.
+    """
+    return int.from_bytes(_digest(item, salt=salt), 'big')
+
+
+class HyperLogLog(object):
+    """
+    Distinct count estimator using 2**precision one byte registers.
+
+    Relative standard error is 1.04 / sqrt(2**precision): about 0.81% for
+    the default precision of 14, which costs 16KB of memory.
+    """
+
+    def __init__(self, precision=14):
+        if not 4 <= precision <= 18:
+            raise ValueError('precision must be between 4 and 18')
+        self.precision = precision
+        self.m = 1 << precision
+        self.registers = bytearray(self.m)
+        if self.m >= 128:
+            self.alpha = 0.7213 / (1 + 1.079 / self.m)
+        else:
+            self.alpha = {16: 0.673, 32: 0.697, 64: 0.709}[self.m]
+
+    @property
+    def error(self):
+        return 1.04 / math.sqrt(self.m)
+
+    def add(self, item):
+        h = hash64(item)
+        idx = h >> (64 - self.precision)
+        rest = h & ((1 << (64 - self.precision)) - 1)
+        rank = (64 - self.precision) - rest.bit_length() + 1
+        if rank > self.registers[idx]:
+            self.registers[idx] = rank
+
+    def count(self):
+        registers = self.registers
+        estimate = self.alpha * self.m * self.m / sum(2.0 ** -r for r in registers)
+        if estimate <= 2.5 * self.m:
+            zeros = registers.count(0)
+            if zeros:
+                return int(round(self.m * math.log(float(self.m) / zeros)))
+        return int(round(estimate))
+
+    def merge(self, other):
+        if other.precision != self.precision:
+            raise ValueError('cannot merge sketches of different precision')
+        self.registers = bytearray(max(a, b) for a, b in zip(self.registers, other.registers))
+
+    def __len__(self):
+        return self.count()
+
+
+class CountMinSketch(object):
+    """
+    Frequency estimator for a stream of keys.
+
+    Estimates never undercount. With width = ceil(e / epsilon) and
+    depth = ceil(ln(1 / delta)) an estimate exceeds the true count by more
+    than epsilon * total only with probability delta.
+    """
+
+    def __init__(self, width=2048, depth=5):
+        self.width = width
+        self.depth = depth
+        self.total = 0
+        self.rows = [[0] * width for _ in range(depth)]
+
+    @classmethod
+    def from_error(cls, epsilon=0.001, delta=0.01):
+        return cls(width=int(math.ceil(math.e / epsilon)),
+                   depth=int(math.ceil(math.log(1.0 / delta))))
+
+    @property
+    def error(self):
+        """
+        => (epsilon, delta) of the over count bound
+        """
+        return math.e / self.width, math.exp(-self.depth)
+
+    def _indexes(self, item):
+        digest = _digest(item, 16)
+        h1 = int.from_bytes(digest[:8], 'big')
+        h2 = int.from_bytes(digest[8:], 'big')
+        width = self.width
+        return [(h1 + i * h2) % width for i in range(self.depth)]
+
+    def add(self, item, count=1):
+        self.total += count
+        for row, idx in zip(self.rows, self._indexes(item)):
+            row[idx] += count
+
+    def estimate(self, item):
+        return min(row[idx] for row, idx in zip(self.rows, self._indexes(item)))
+
+    __getitem__ = estimate
+
+
+class BloomFilter(object):
+    """
+    Set membership test with false positives but no false negatives.
+
+    capacity: items the filter is sized for; once that many were added it
+    starts over empty, so the false positive rate stays below error.
+    Memory is about -capacity * ln(error) / ln(2)**2 bits: 1917012 bits, or
+    240KB, for the default 100000 items at 1 in 10000.
+    """
+
+    def __init__(self, capacity=100000, error=0.0001):
+        if not 0 < error < 1:
+            raise ValueError('error must be between 0 and 1')
+        self.capacity = capacity
+        self.m = int(math.ceil(-capacity * math.log(error) / math.log(2) ** 2))
+        self.k = max(1, int(round(self.m / capacity * math.log(2))))
+        self.bits = bytearray((self.m + 7) // 8)
+        self.items = 0
+        self.hits = 0
+
+    @property
+    def error(self):
+        """
+        => expected false positive rate at the current fill
+        """
+        return (1 - math.exp(-self.k * self.items / self.m)) ** self.k
+
+    def _indexes(self, item):
+        digest = _digest(item, 16)
+        h1 = int.from_bytes(digest[:8], 'big')
+        h2 = int.from_bytes(digest[8:], 'big')
+        m = self.m
+        return [(h1 + i * h2) % m for i in range(self.k)]
+
+    def add(self, item):
+        if self.items >= self.capacity:
+            self.clear()
+        bits = self.bits
+        for idx in self._indexes(item):
+            bits[idx >> 3] |= 1 << (idx & 7)
+        self.items += 1
+
+    def __contains__(self, item):
+        bits = self.bits
+        for idx in self._indexes(item):
+            if not bits[idx >> 3] & (1 << (idx & 7)):
+                return False
+        self.hits += 1
+        return True
+
+    def __len__(self):
+        return self.items
+
+    def clear(self):
+        self.bits = bytearray(len(self.bits))
+        self.items = 0
+
+
+class SpaceSaving(object):
+    """
+    Top-K heavy hitters in k counters (Metwally et al.).
+
+    Every key seen more than total / k times is reported. For a reported
+    key, count - error <= true count <= count.
+    """
+
+    def __init__(self, k=100):
+        self.k = k
+        self.total = 0
+        self.counts = {}
+        self.errors = {}
+        self._heap = []
+
+    def add(self, item, count=1):
+        self.total += count
+        counts = self.counts
+        if item in counts:
+            counts[item] += count
+            return
+        if len(counts) < self.k:
+            counts[item] = count
+            self.errors[item] = 0
+            heapq.heappush(self._heap, (count, item))
+            return
+        # heap entries go stale as counters grow; refresh them lazily
+        while True:
+            low, victim = heapq.heappop(self._heap)
+            if counts[victim] == low:
+                break
+            heapq.heappush(self._heap, (counts[victim], victim))
+        del counts[victim]
+        del self.errors[victim]
+        counts[item] = low + count
+        self.errors[item] = low
+        heapq.heappush(self._heap, (low + count, item))
+
+    def top(self, n=None):
+        """
+        => [(item, count, error), ...] most frequent first
+        """
+        ranked = sorted(self.counts.items(), key=lambda kv: kv[1], reverse=True)
+        return [(item, count, self.errors[item]) for item, count in ranked[:n]]
+
+
+def browser_family(result):
+    return result.get('browser', {}).get('name') or httpagentparser.UNKNOWN_BROWSER_NAME
+
+
+class UAStreamStats(object):
+    """
+    Constant memory summary of a UA stream.
+
+    family: callable mapping a detect() result to the family key that is
+    counted (browser name by default).
+    """
+
+    def __init__(self, precision=14, width=2048, depth=5, k=100, family=browser_family):
+        self.family = family
+        self.distinct_agents = HyperLogLog(precision)
+        self.distinct_families = HyperLogLog(precision)
+        self.families = CountMinSketch(width, depth)
+        self.top_agents = SpaceSaving(k)
+
+    def add(self, agent, result=None):
+        """
+        result: detect() output for agent, parsed here when not supplied
+        """
+        if result is None:
+            result = httpagentparser.detect(agent)
+        family = self.family(result)
+        self.distinct_agents.add(agent)
+        self.distinct_families.add(family)
+        self.families.add(family)
+        self.top_agents.add(agent)
+        return result
+
+    def summary(self, n=10):
+        return dict(
+            requests=self.families.total,
+            distinct_agents=self.distinct_agents.count(),
+            distinct_families=self.distinct_families.count(),
+            top_agents=self.top_agents.top(n),
+        )
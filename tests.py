@@ -224,5 +224,1163 @@ class TestHAP(unittest.TestCase):
         self.assertEqual(result['browser']['name'], 'AndroidBrowser')
         self.assertEqual(result['browser']['version'], None)
 
+
+class TestSketches(unittest.TestCase):
+    def test_hyperloglog(self):
+        from httpagentparser.sketches import HyperLogLog
+        hll = HyperLogLog(precision=12)
+        for i in range(20000):
+            hll.add('agent %s' % i)
+            hll.add('agent %s' % i)
+        self.assertLess(abs(hll.count() - 20000), 20000 * hll.error * 3)
+
+    def test_count_min(self):
+        from httpagentparser.sketches import CountMinSketch
+        cms = CountMinSketch.from_error(epsilon=0.01, delta=0.01)
+        for i in range(1000):
+            cms.add('family %s' % (i % 10), count=i % 10 + 1)
+        epsilon, _ = cms.error
+        for i in range(10):
+            true = 100 * (i + 1)
+            self.assertGreaterEqual(cms.estimate('family %s' % i), true)
+            self.assertLessEqual(cms.estimate('family %s' % i), true + epsilon * cms.total)
+
+    def test_space_saving(self):
+        from httpagentparser.sketches import SpaceSaving
+        ss = SpaceSaving(k=10)
+        for i in range(5000):
+            ss.add('heavy %s' % (i % 3) if i % 2 else 'junk %s' % i)
+        top = [item for item, count, error in ss.top(3)]
+        self.assertEqual(sorted(top), ['heavy 0', 'heavy 1', 'heavy 2'])
+        for item, count, error in ss.top():
+            self.assertLessEqual(count - error, ss.total)
+
+    def test_bloom_filter(self):
+        from httpagentparser.sketches import BloomFilter
+        bloom = BloomFilter(capacity=2000, error=0.01)
+        for i in range(2000):
+            bloom.add('member %s' % i)
+        self.assertTrue(all('member %s' % i in bloom for i in range(2000)))
+        false_positives = sum(1 for i in range(10000) if 'other %s' % i in bloom)
+        self.assertLess(false_positives, 10000 * 0.01 * 2)
+        self.assertLess(bloom.error, 0.011)
+        bloom.add('one more')  # over capacity: starts over
+        self.assertEqual(len(bloom), 1)
+        self.assertFalse('member 1' in bloom)
+
+    def test_stream_stats(self):
+        from httpagentparser.sketches import UAStreamStats
+        stats = UAStreamStats(precision=10, k=5)
+        for agent, simple_res, res in data * 3:
+            stats.add(agent)
+        summary = stats.summary(n=1)
+        self.assertEqual(summary['requests'], len(data) * 3)
+        chrome = sum(1 for agent, _, _ in data if detect(agent).get('browser', {}).get('name') == 'Chrome')
+        self.assertGreaterEqual(stats.families.estimate('Chrome'), 3 * chrome)
+
+
+class TestSampling(unittest.TestCase):
+    def stream(self):
+        import random
+        rnd = random.Random(3)
+        return [rnd.choice(data)[0] + ' v%d' % rnd.randrange(300) for _ in range(20000)]
+
+    def test_consistent_across_nodes(self):
+        from httpagentparser.sampling import HashSampler
+        first, second = HashSampler(0.1, salt=b'fleet'), HashSampler(0.1, salt=b'fleet')
+        agents = [agent for agent, _, _ in data]
+        self.assertEqual([first.selected(a) for a in agents], [second.selected(a) for a in agents])
+        self.assertEqual(HashSampler(1).detect(agents[0]), detect(agents[0]))
+
+    def test_estimates_cover_truth(self):
+        from collections import Counter
+        from httpagentparser.sampling import SampledCounter
+        stream = self.stream()
+        truth = Counter()
+        for agent in stream:
+            truth[detect(agent).get('browser', {}).get('name')] += 1
+        for by in ('agent', 'request'):
+            counter = SampledCounter(0.2, by=by, salt=b'test')
+            for i, agent in enumerate(stream):
+                counter.add(agent, request_key=str(i))
+            self.assertEqual(counter.seen, len(stream))
+            self.assertLess(abs(counter.sampled - 0.2 * len(stream)), 0.05 * len(stream))
+            estimates = counter.estimates(confidence=0.999)
+            covered = sum(1 for key, (_, low, high) in estimates.items() if low <= truth[key] <= high)
+            self.assertGreaterEqual(covered, len(estimates) - 1, by)
+
+    def test_merge(self):
+        from httpagentparser.sampling import SampledCounter
+        stream = self.stream()[:4000]
+        whole, first, second = [SampledCounter(0.3) for _ in range(3)]
+        for i, agent in enumerate(stream):
+            whole.add(agent)
+            (first if i % 2 else second).add(agent)
+        first.merge(second)
+        self.assertEqual(first.estimates(), whole.estimates())
+        self.assertRaises(ValueError, first.merge, SampledCounter(0.3, by='request'))
+
+    def test_bounded_agents(self):
+        from httpagentparser.sampling import SampledCounter
+        stream = self.stream()
+        exact, first, second = SampledCounter(0.5), SampledCounter(0.5, max_agents=50), SampledCounter(0.5, max_agents=50)
+        for i, agent in enumerate(stream):
+            exact.add(agent)
+            (first if i % 2 else second).add(agent)
+        self.assertLessEqual(len(second.agents), 50)
+        self.assertGreater(second.floor, 0)
+        first.merge(second)
+        self.assertLessEqual(len(first.agents), 50)
+        self.assertEqual(first.counts, exact.counts)
+        for key, (estimate, low, high) in exact.estimates().items():
+            bounded = first.estimate(key)
+            self.assertEqual(bounded[0], estimate)
+            self.assertLessEqual(bounded[1], low)
+            self.assertGreaterEqual(bounded[2], high)
+
+
+class TestCache(unittest.TestCase):
+    def setUp(self):
+        import tempfile
+        self.tmpdir = tempfile.mkdtemp()
+        self.path = self.tmpdir + '/cache.sqlite3'
+
+    def tearDown(self):
+        import shutil
+        shutil.rmtree(self.tmpdir)
+
+    def test_lru(self):
+        from httpagentparser.cache import LRUCache
+        cache = LRUCache(maxsize=2)
+        cache.set('a', 1)
+        cache.set('b', 2)
+        cache.get('a')
+        cache.set('c', 3)
+        self.assertEqual(cache.get('b'), None)
+        self.assertEqual(cache.get('a'), 1)
+        self.assertEqual(cache.stats(), dict(hits=2, misses=1, evictions=1, size=2))
+
+    def test_persistent_across_runs(self):
+        from httpagentparser.cache import CachedDetector, PersistentCache
+        agents = [agent for agent, _, _ in data]
+        with PersistentCache(self.path, batch_size=7) as store:
+            first = CachedDetector(store=store)
+            self.assertEqual(first.detect_many(agents), [detect(agent) for agent in agents])
+            self.assertEqual(first.parsed, len(set(agents)))
+        with PersistentCache(self.path) as store:
+            second = CachedDetector(store=store)
+            self.assertEqual(second.detect_many(agents + ['runscope-radar/3.0']),
+                             [detect(agent) for agent in agents + ['runscope-radar/3.0']])
+            self.assertEqual(second.parsed, 1)
+
+    def test_namespace_invalidates(self):
+        from httpagentparser.cache import PersistentCache
+        with PersistentCache(self.path, namespace='old') as store:
+            store.set('agent', {'bot': True})
+        with PersistentCache(self.path) as store:
+            self.assertEqual(store.get('agent'), None)
+            store.purge()
+        with PersistentCache(self.path, namespace='old') as store:
+            self.assertEqual(len(store), 0)
+
+    def test_warm(self):
+        from httpagentparser.cache import CachedDetector, PersistentCache
+        agent = data[0][0]
+        with PersistentCache(self.path) as store:
+            CachedDetector(store=store).detect(agent)
+            cached = CachedDetector(store=store)
+            self.assertEqual(cached.warm(), 1)
+            result = cached.detect(agent)
+            result['browser']['name'] = 'changed'
+            self.assertEqual(cached.detect(agent), detect(agent))
+            self.assertEqual(cached.parsed, 0)
+
+    def test_bytes_keys(self):
+        from httpagentparser.cache import CachedDetector, PersistentCache
+        raw = [agent.encode('utf-8') for agent, _, _ in data]
+        views = [memoryview(agent) for agent in raw]
+        with PersistentCache(self.path) as store:
+            cached = CachedDetector(store=store)
+            self.assertEqual(cached.detect_many(views), [detect(agent) for agent, _, _ in data])
+            self.assertEqual(cached.parsed, len(set(raw)))
+            self.assertEqual(cached.detect(raw[0]), detect(data[0][0]))
+            self.assertEqual(cached.parsed, len(set(raw)))
+            self.assertFalse(any(isinstance(key, memoryview) for key in cached.cache.data))
+            self.assertEqual(CachedDetector(store=store).detect(bytearray(raw[1])), detect(data[1][0]))
+
+    def test_frozen(self):
+        from httpagentparser.cache import CachedDetector, PersistentCache
+        agent = data[0][0]
+        with PersistentCache(self.path) as store:
+            CachedDetector(store=store).detect(agent)
+            cached = CachedDetector(store=store, frozen=True)
+            result = cached.detect(agent)
+            self.assertIsInstance(result, httpagentparser.FrozenDict)
+            self.assertEqual(result, detect(agent))
+            self.assertIs(cached.detect(agent), result)
+            self.assertIs(cached.detect_many([agent, agent])[1], result)
+            self.assertEqual(cached.parsed, 0)
+
+
+class TestFrozenResult(unittest.TestCase):
+    def test_immutable(self):
+        result = detect(data[0][0], frozen=True)
+        self.assertEqual(result, detect(data[0][0]))
+        for mutate in (lambda: result.__setitem__('bot', True), lambda: result.pop('os'),
+                       lambda: result['os'].update(name='x'), result.clear):
+            self.assertRaises(TypeError, mutate)
+        copy = dict(result)
+        copy['bot'] = True
+        self.assertEqual(result.copy(), detect(data[0][0]))
+        thawed = httpagentparser.thaw_result(detect(data[0][0], record_detectors=True, frozen=True))
+        thawed['os']['name'] = 'x'
+        thawed['detectors'].append('x')
+        self.assertEqual(type(thawed['os']), dict)
+        from httpagentparser.cache import copy_result
+        copy_result(result)['os']['name'] = 'x'
+
+    def test_shared(self):
+        agents = [agent for agent, _, _ in data]
+        first = [detect(agent, frozen=True) for agent in agents]
+        second = [detect(agent, frozen=True) for agent in agents]
+        self.assertTrue(all(a is b for a, b in zip(first, second)))
+        self.assertEqual(len(set(first)), len(set(map(str, first))))
+        recorded = detect(agents[0], record_detectors=True, frozen=True)
+        self.assertIsInstance(recorded['detectors'], tuple)
+
+    def test_pickle(self):
+        import pickle
+        result = detect(data[0][0], frozen=True)
+        copy = pickle.loads(pickle.dumps(result))
+        self.assertIsInstance(copy, httpagentparser.FrozenDict)
+        self.assertEqual(copy, result)
+
+    def test_simple_detect_cached(self):
+        for agent, _, _ in data:
+            result = detect(agent, frozen=True)
+            self.assertEqual(httpagentparser.simple_detect(agent, result), httpagentparser.simple_detect(agent))
+            self.assertIs(httpagentparser.simple_detect(agent, result), httpagentparser.simple_detect(agent, result))
+            self.assertIs(httpagentparser.simple_detect_tuple(agent, result),
+                          httpagentparser.simple_detect_tuple(agent, result))
+
+
+class TestNormalize(unittest.TestCase):
+    def corpus(self):
+        with open('useragent.txt') as f:
+            return [agent for agent, _, _ in data] + [line.strip() for line in f if len(line.strip()) > 5]
+
+    def test_rules_preserve_results(self):
+        from httpagentparser.normalize import check_rules
+        self.assertEqual(check_rules(self.corpus()), {'gzip': [], 'language': [], 'dotnet': []})
+
+    def test_language_slots(self):
+        import re
+        from httpagentparser.normalize import check_rules, normalize
+        chromeos = 'Mozilla/5.0 (X11; CrOS i686 2465.163.0; en-US) AppleWebKit/537.1 (KHTML, like Gecko) Chrome/21.0.1180.0'
+        self.assertEqual(detect(normalize(chromeos)), detect(chromeos))
+        # a locale put in every ";" or ")" slot of the corpus agents never changes a result
+        agents = set()
+        for agent in self.corpus():
+            for slot in re.finditer(r'[;)]', agent):
+                for lang in ('; en-US', ';en-US', '; de'):
+                    agents.add(agent[:slot.start()] + lang + agent[slot.start():])
+        self.assertEqual(check_rules(agents), {'gzip': [], 'language': [], 'dotnet': []})
+
+    def test_rules(self):
+        from httpagentparser.normalize import normalize
+        self.assertEqual(normalize('Mozilla/5.0 (X11; U; Linux i686; en-US; rv:1.9.2) Gecko/20100308 Firefox/3.6'),
+                         'Mozilla/5.0 (X11; U; Linux i686; rv:1.9.2) Gecko/20100308 Firefox/3.6')
+        self.assertEqual(normalize('Mozilla/5.0 (compatible; MSIE 8.0; Windows NT 6.0; .NET CLR 2.0.50727; .NET4.0C)'),
+                         'Mozilla/5.0 (compatible; MSIE 8.0; Windows NT 6.0)')
+        self.assertEqual(normalize(data[2][0]), data[2][0][:-len(',gzip(gfe)')])
+        android = 'Mozilla/5.0 (Linux; U; Android 2.2.1; fr-ch; A43 Build/FROYO) AppleWebKit/533.1'
+        self.assertEqual(normalize(android), android)
+
+    def test_cardinality_and_cache(self):
+        from httpagentparser.cache import CachedDetector
+        from httpagentparser.normalize import cardinality, normalize
+        agents = ['Mozilla/5.0 (Windows; U; Windows NT 5.1; %s; rv:1.7.5) Gecko/20060127 Netscape/8.1' % lang
+                  for lang in ('en-US', 'fr-FR', 'de', 'pt-BR')]
+        self.assertEqual(cardinality(agents), dict(raw=4, normalized=1, reduction=0.75))
+        cached = CachedDetector(normalizer=normalize)
+        self.assertEqual(cached.detect_many(agents), [detect(agent) for agent in agents])
+        self.assertEqual(cached.parsed, 1)
+
+
+class TestSharedMemoryCache(unittest.TestCase):
+    def setUp(self):
+        import tempfile
+        self.tmpdir = tempfile.mkdtemp()
+        self.path = self.tmpdir + '/shm.cache'
+
+    def tearDown(self):
+        import shutil
+        shutil.rmtree(self.tmpdir)
+
+    def test_shared_between_mappings(self):
+        from httpagentparser.cache import CachedDetector
+        from httpagentparser.shmcache import SharedMemoryCache
+        worker1 = CachedDetector(cache=SharedMemoryCache(self.path, slots=4096))
+        worker2 = CachedDetector(cache=SharedMemoryCache(self.path, slots=4096))
+        agents = [agent for agent, _, _ in data]
+        self.assertEqual(worker1.detect_many(agents), [detect(agent) for agent in agents])
+        self.assertEqual(worker2.detect_many(agents), [detect(agent) for agent in agents])
+        self.assertEqual(worker2.parsed, 0)
+
+    def test_frozen(self):
+        from httpagentparser.cache import CachedDetector
+        from httpagentparser.shmcache import SharedMemoryCache
+        agent = data[0][0]
+        CachedDetector(cache=SharedMemoryCache(self.path, slots=64)).detect(agent)
+        cached = CachedDetector(cache=SharedMemoryCache(self.path, slots=64), frozen=True)
+        result = cached.detect(agent)
+        self.assertEqual(cached.parsed, 0)
+        self.assertIsInstance(result, httpagentparser.FrozenDict)
+        self.assertIs(result, detect(agent, frozen=True))
+        self.assertIs(cached.detect_many([agent])[0], result)
+
+    def test_forked_writer(self):
+        import multiprocessing
+        from httpagentparser.shmcache import SharedMemoryCache
+        cache = SharedMemoryCache(self.path, slots=64)
+        ctx = multiprocessing.get_context('fork')
+        proc = ctx.Process(target=lambda: SharedMemoryCache(self.path, slots=64).set('agent', {'bot': True}))
+        proc.start()
+        proc.join()
+        self.assertEqual(cache.get('agent'), {'bot': True})
+
+    def test_bounded(self):
+        from httpagentparser.shmcache import SharedMemoryCache
+        cache = SharedMemoryCache(self.path, slots=8, probes=2)
+        for i in range(100):
+            cache.set('agent %s' % i, {'i': i})
+        self.assertEqual(cache.get('agent 99'), {'i': 99})
+        self.assertGreater(cache.evictions, 0)
+        self.assertFalse(cache.set('big', {'x': 'y' * 1000}))
+        self.assertEqual(cache.stats()['size'], 8)
+        cache.clear()
+        cache.set('agent', {'bot': True})
+        self.assertEqual(cache.stats()['size'], 1)
+
+    def test_other_geometry_while_mapped(self):
+        import os
+        from httpagentparser.shmcache import SharedMemoryCache, default_path
+        first = SharedMemoryCache(self.path, slots=4096)
+        first.set('agent', {'bot': True})
+        size = os.path.getsize(self.path)
+        second = SharedMemoryCache(self.path, slots=16, slot_size=256)
+        # the first mapping is left whole, the path now holds the second table
+        self.assertTrue(first.set('other agent', {'bot': False}))
+        self.assertEqual(first.get('agent'), {'bot': True})
+        self.assertEqual(second.get('agent'), None)
+        self.assertEqual(os.path.getsize(self.path), second.size)
+        self.assertNotEqual(second.size, size)
+        self.assertNotEqual(default_path('ns', 4096), default_path('ns', 16, 256))
+
+
+class TestFrozenOS(unittest.TestCase):
+    safari = 'Mozilla/5.0 (Macintosh; Intel Mac OS X 10_15_7) AppleWebKit/605.1.15 (KHTML, like Gecko) Version/%s Safari/605.1.15'
+
+    def inferred(self, version):
+        return detect(self.safari % version, infer_frozen_os=True)['flavor'].get('inferred')
+
+    def test_safari(self):
+        self.assertEqual(self.inferred('14.0.3'), 'Mac OS X 11.0 - 11.2')
+        self.assertEqual(self.inferred('14.1.2'), 'Mac OS X 11.3+')
+        self.assertEqual(self.inferred('15.4'), 'Mac OS X 12.3')
+        self.assertEqual(self.inferred('18.0.1'), 'Mac OS X 13.x;Mac OS X 14.x;Mac OS X 15.0.1')
+        self.assertEqual(self.inferred('18.0'), 'Mac OS X 13.x;Mac OS X 14.x;Mac OS X 15')
+        self.assertEqual(self.inferred('26.2'), 'Mac OS X 14.x;Mac OS X 15.x;Mac OS X 26.2')
+        self.assertEqual(self.inferred('17.14'), 'Mac OS X 12.x;Mac OS X 13.x;Mac OS X 14.x')
+        self.assertEqual(self.inferred('13.1'), None)
+        self.assertEqual(self.inferred('21.0'), None)
+
+    def test_chrome(self):
+        s = 'Mozilla/5.0 (Macintosh; Intel Mac OS X 10_15_7) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/124.0.0.0 Safari/537.36'
+        result = detect(s, infer_frozen_os=True)
+        self.assertEqual(result['flavor']['inferred'], httpagentparser.CHROME_FROZEN_MACOS)
+        self.assertEqual(simple_detect(s, parsed_agent=result)[0],
+                         'MacOS Macintosh 10.15.7;' + httpagentparser.CHROME_FROZEN_MACOS)
+
+    def test_opt_in(self):
+        self.assertNotIn('inferred', detect(self.safari % '17.1')['flavor'])
+
+
+class TestReclassify(unittest.TestCase):
+    def test_fingerprint_tracks_detectors(self):
+        hub = httpagentparser.DetectorsHub()
+        before = hub.fingerprint()
+        self.assertEqual(before, httpagentparser.DetectorsHub().fingerprint())
+
+        class Mosaic(httpagentparser.Browser):
+            look_for = 'Mosaic'
+        hub.register(Mosaic())
+        self.assertNotEqual(hub.fingerprint(), before)
+
+    def test_record_detectors(self):
+        result = detect(data[0][0], record_detectors=True)
+        self.assertEqual(result['detectors'], ['os.Windows', 'browser.ChromiumEdge'])
+        self.assertNotIn('detectors', detect(data[0][0]))
+
+    def test_reparse_only_affected(self):
+        from httpagentparser.reclassify import Reclassifier
+        hub = httpagentparser.DetectorsHub()
+        old = hub.fingerprints()
+        rows = [(agent, detect(agent, record_detectors=True)['detectors']) for agent, _, _ in data]
+        old = [(i, 'stale' if i == 'browser.Netscape' else fp) for i, fp in old]
+        reclassifier = Reclassifier(old, hub=hub)
+        reparsed = [agent for agent, result in reclassifier.reclassify(rows)]
+        self.assertEqual(reparsed, [agent for agent, _ in rows if 'Netscape' in agent])
+        self.assertEqual(reclassifier.checked, len(rows))
+
+
+def pathological_agents(size):
+    """
+    => {name: agent of about size characters} designed to stress the detectors
+    """
+    base = data[0][0] + ' '
+    return dict(
+        repeated_agent=(base * (size // len(base) + 1))[:size],
+        repeated_tokens=('Chrome/1.0 Windows Android Mac OS Opera Version/ ' * size)[:size],
+        nested_parens='(' * (size // 2) + ')' * (size // 2),
+        separators='Windows ' + ';' * size,
+    )
+
+
+class TestInputBudget(unittest.TestCase):
+    def test_truncate(self):
+        agent = data[0][0] + ' ' + 'x' * 70000
+        self.assertEqual(detect(agent), detect(agent[:httpagentparser.MAX_AGENT_LENGTH]))
+        self.assertEqual(detect(agent, max_length=20), detect(agent[:20]))
+        self.assertEqual(detect(agent, max_length=0), detect(data[0][0] + ' '))
+
+    def test_reject(self):
+        agent = data[0][0]
+        self.assertEqual(detect(agent, max_length=20, overflow='reject'), detect(''))
+        self.assertEqual(detect(agent, max_length=len(agent), overflow='reject'), detect(agent))
+        self.assertRaises(ValueError, detect, agent, max_length=20, overflow='ignore')
+
+    def test_none(self):
+        self.assertEqual(detect(None), {'platform': {'name': None, 'version': None}})
+        self.assertEqual(simple_detect(None), ('Unknown OS', 'Unknown Browser', ''))
+
+    def test_linear_cost(self):
+        def cost(agent):
+            # best of several runs: a loaded machine only ever adds time
+            best = None
+            for _ in range(7):
+                then = time.perf_counter()
+                detect(agent, max_length=0)
+                taken = time.perf_counter() - then
+                best = taken if best is None else min(best, taken)
+            return best
+
+        small, large = pathological_agents(4096), pathological_agents(65536)
+        for name in small:
+            # 16x the input: linear cost stays well under the 256x of a quadratic one
+            self.assertLess(cost(large[name]), 96 * cost(small[name]), name)
+
+
+class TestBytesInput(unittest.TestCase):
+    def test_same_results(self):
+        for agent, _, _ in data:
+            raw = agent.encode('utf-8')
+            self.assertEqual(detect(raw), detect(agent))
+            self.assertEqual(detect(memoryview(raw)), detect(agent))
+            self.assertEqual(simple_detect(bytearray(raw)), simple_detect(agent))
+
+    def test_invalid_utf8(self):
+        raw = data[0][0].encode('utf-8') + b' \xff\xfe caf\xc3'
+        self.assertEqual(detect(raw), detect(data[0][0] + ' \ufffd\ufffd caf\ufffd'))
+
+    def test_decode_only_prefix(self):
+        agent = data[0][0] + ' \u00e9\u4e2d' * 5000
+        raw = agent.encode('utf-8')
+        for max_length in (20, 200, len(data[0][0]) + 7):
+            self.assertTrue(len(httpagentparser.decode_agent(raw, max_length)) > max_length)
+            self.assertEqual(detect(raw, max_length=max_length), detect(agent, max_length=max_length))
+            self.assertEqual(detect(raw, max_length=max_length, overflow='reject'), detect(''))
+
+
+class TestScan(unittest.TestCase):
+    def setUp(self):
+        import tempfile
+        self.tmpdir = tempfile.mkdtemp()
+        self.path = self.tmpdir + '/agents.log'
+        self.agents = [agent for agent, _, _ in data] * 3 + ['', '  ']
+        with open(self.path, 'wb') as f:
+            f.write('\r\n'.join(self.agents).encode('utf-8') + b'\n\xff\xfe')
+
+    def tearDown(self):
+        import shutil
+        shutil.rmtree(self.tmpdir)
+
+    def test_ranges(self):
+        from httpagentparser.scan import split_ranges
+        import os
+        ranges = split_ranges(self.path, chunk_size=1000)
+        self.assertEqual(ranges[0][0], 0)
+        self.assertEqual(ranges[-1][1], os.path.getsize(self.path))
+        with open(self.path, 'rb') as f:
+            content = f.read()
+        for (_, end), (start, _) in zip(ranges, ranges[1:]):
+            self.assertEqual(end, start)
+            self.assertEqual(content[end - 1:end], b'\n')
+
+    def test_scan_ordered(self):
+        from httpagentparser.scan import scan_file, split_ranges
+        expected = [(agent, simple_detect(agent)) for agent in self.agents if agent.strip()]
+        expected.append(('\ufffd\ufffd', simple_detect('\ufffd\ufffd')))
+        self.assertEqual(list(scan_file(self.path, workers=1)), expected)
+        # more ranges than the two per worker kept in flight
+        self.assertGreater(len(split_ranges(self.path, chunk_size=1000)), 4)
+        self.assertEqual(list(scan_file(self.path, workers=2, chunk_size=1000)), expected)
+
+    def test_count(self):
+        from collections import Counter
+        from httpagentparser.scan import count_file
+        expected = Counter(simple_detect(agent) for agent in self.agents if len(agent) >= 6)
+        self.assertEqual(count_file(self.path, workers=2, chunk_size=1000, min_length=6), expected)
+
+    def test_where(self):
+        from httpagentparser.filters import compile_filter
+        from httpagentparser.scan import scan_file
+        where = compile_filter(bot=True)
+        expected = [(agent, simple_detect(agent)) for agent in self.agents if agent.strip() and detect(agent)['bot']]
+        self.assertTrue(expected)
+        self.assertEqual(list(scan_file(self.path, workers=2, chunk_size=1000, where=where)), expected)
+        # lines are matched as where(agent) matches them, with its detect_kw
+        where, unlimited = compile_filter(detect_kw=dict(max_length=40), bot=True), expected
+        expected = [(agent, simple_detect(agent)) for agent in self.agents if agent.strip() and where(agent)]
+        self.assertLess(len(expected), len(unlimited))
+        self.assertEqual(list(scan_file(self.path, workers=1, where=where)), expected)
+
+
+class TestFilters(unittest.TestCase):
+    def test_version_key(self):
+        from httpagentparser.filters import version_key
+        self.assertEqual(version_key('100.0.4896.127'), (100, 0, 4896, 127))
+        self.assertEqual(version_key('10_15_7'), (10, 15, 7))
+        self.assertEqual(version_key('9.64b'), (9, 64))
+        self.assertEqual(version_key('beta'), ())
+
+    def test_same_as_detect(self):
+        from httpagentparser.filters import compile_filter
+        filters = [compile_filter(browser__name='Chrome', browser__version__major__lt=100, os__name='Windows'),
+                   compile_filter(bot=True, browser__name__ne='GoogleBot'),
+                   compile_filter(browser__name__in=('Firefox', 'Opera'), browser__version__gte='10'),
+                   compile_filter(platform__name='Android', model__ne=None)]
+        with open('useragent.txt') as f:
+            agents = [agent for agent, _, _ in data] + [line.strip() for line in f]
+        for where in filters:
+            matching = [agent for agent in agents if where.matches(detect(agent))]
+            self.assertTrue(matching)
+            self.assertEqual([agent for agent in agents if where(agent) is not None], matching)
+            self.assertLess(sum(map(where.may_match, agents)), len(agents) / 2)
+
+    def test_pushdown(self):
+        from httpagentparser.filters import compile_filter
+        where = compile_filter(browser__name='Firefox', os__version__major__gt=5)
+        self.assertEqual(len(where.tokens()), 1)
+        self.assertFalse(where.may_match('Mozilla/5.0 (Windows NT 10.0) Chrome/99.0 Safari/537.36'))
+        self.assertEqual(compile_filter(bot=False).tokens(), [])
+        self.assertEqual(compile_filter(os__name='Nope').may_match('Nope'), False)
+        self.assertRaises(ValueError, compile_filter, os__nmae='Windows')
+        self.assertRaises(ValueError, compile_filter, os__name__major=1)
+
+
+class TestMetrics(unittest.TestCase):
+    def tearDown(self):
+        from httpagentparser import metrics
+        metrics.disable()
+
+    def test_disabled_by_default(self):
+        from httpagentparser import metrics
+        self.assertEqual(httpagentparser._metrics, None)
+        self.assertEqual(metrics.render(), '')
+
+    def test_counts(self):
+        from httpagentparser import metrics
+        from httpagentparser.cache import CachedDetector
+        agents = [agent for agent, _, _ in data] + ['', 'Googlebot/2.1 (+http://www.google.com/bot.html)']
+        calls = len(set(agents))
+        bots = sum(1 for a in set(agents) if detect(a).get('bot'))
+        unknown = sum(1 for a in set(agents) if simple_detect(a)[1] == httpagentparser.UNKNOWN_BROWSER_NAME)
+
+        collected = metrics.enable(metrics.Metrics(buckets=(0.001, 1)))
+        cached = CachedDetector(maxsize=100)
+        metrics.register_cache('ua', cached.cache)
+        for agent in agents:
+            cached.detect(agent)
+        cached.detect('')
+        self.assertEqual(collected.calls, calls)
+        self.assertEqual(collected.bots, bots)
+        self.assertEqual(collected.unknown['browser'], unknown)
+        # matched detectors without model markers are not failures
+        self.assertEqual(collected.exceptions, {})
+
+        text = metrics.render()
+        self.assertIn('httpagentparser_detect_calls_total %d\n' % calls, text)
+        self.assertIn('httpagentparser_detect_seconds_bucket{le="+Inf"} %d\n' % calls, text)
+        self.assertIn('httpagentparser_detect_seconds_count %d\n' % calls, text)
+        self.assertIn('httpagentparser_cache_hits_total{cache="ua"} %d\n' % (len(agents) + 1 - calls), text)
+        self.assertIn('# TYPE httpagentparser_detect_seconds histogram\n', text)
+
+    def test_swallowed(self):
+        from httpagentparser import metrics
+
+        class Broken(httpagentparser.Browser):
+            look_for = 'Broken'
+
+            def getVersion(self, agent, word):
+                raise KeyError(word)
+
+        class Plain(httpagentparser.OS):
+            look_for = 'Plain'
+
+        class BadModel(httpagentparser.Dist):
+            look_for = 'BadModel'
+
+            def getModel(self, agent, word):
+                return agent.model  # a real AttributeError
+
+        hub = httpagentparser.DetectorsHub()
+        hub.register(Broken())
+        hub.register(Plain())
+        hub.register(BadModel())
+        for engine in httpagentparser.ENGINES:
+            collected = metrics.enable(metrics.Metrics())
+            hub.run('Plain BadModel Broken/1', {}, engine=engine)
+            self.assertEqual(collected.exceptions, {('browser.Broken', 'KeyError'): 1,
+                                                    ('dist.BadModel', 'AttributeError'): 1})
+            metrics.disable()
+
+
+class TestSnapshot(unittest.TestCase):
+    def setUp(self):
+        import tempfile
+        self.tmpdir = tempfile.mkdtemp()
+        self.path = self.tmpdir + '/hub.snapshot'
+
+    def tearDown(self):
+        import shutil
+        shutil.rmtree(self.tmpdir)
+
+    def test_roundtrip(self):
+        import json
+        fresh = httpagentparser.DetectorsHub().compile()
+        fresh.save_snapshot(self.path)
+        with open(self.path) as f:
+            snapshot = json.load(f)
+        self.assertEqual(snapshot['version'], httpagentparser.__version__)
+        self.assertEqual(snapshot['fingerprint'], fresh.fingerprint())
+        hub = httpagentparser.DetectorsHub()
+        self.assertTrue(hub.load_snapshot(self.path))
+        original = httpagentparser.DetectorBase.fingerprint
+        httpagentparser.DetectorBase.fingerprint = None  # loaded, so never recomputed
+        try:
+            self.assertEqual(hub.compile().fingerprints(), httpagentparser.detectorshub.fingerprints())
+        finally:
+            httpagentparser.DetectorBase.fingerprint = original
+        self.assertEqual(hub.token_index().state(), fresh.token_index().state())
+        table = lambda h: dict((key, ([d.detector_id for d in entry.detectors], entry.words))
+                               for key, entry in h.dispatch_table().items())
+        self.assertEqual(table(hub), table(fresh))
+        agent = 'Mozilla/5.0 (X11; CrOS x86_64 14541.0.0) AppleWebKit/537.36 Chrome/120.0.0.0 Safari/537.36'
+        ids = lambda detectors: [d.detector_id for d in detectors]
+        for agent in [agent, 'curl/7.68.0', 'Python-urllib/3.11', 'Java/17.0.2']:
+            self.assertEqual(ids(hub.candidates(agent)), ids(fresh.candidates(agent)))
+
+    def test_stale_snapshot(self):
+        class Extra(httpagentparser.Browser):
+            look_for = 'Extra'
+
+        httpagentparser.DetectorsHub().save_snapshot(self.path)
+        hub = httpagentparser.DetectorsHub()
+        hub.register(Extra())
+        self.assertFalse(hub.load_snapshot(self.path))
+        self.assertFalse(hub.load_snapshot(self.tmpdir + '/missing'))
+        self.assertIn('browser.Extra', dict(hub.fingerprints()))
+
+    def test_register_drops_compiled(self):
+        class Extra(httpagentparser.Browser):
+            look_for = 'Extra'
+
+        hub = httpagentparser.DetectorsHub().compile()
+        hub.register(Extra())
+        self.assertEqual(hub.detectors()[-1].name, 'Extra')
+
+    def test_warmup(self):
+        import gc
+        httpagentparser.warmup(snapshot=self.path)
+        try:
+            self.assertGreater(gc.get_freeze_count(), 0)
+            self.assertTrue(httpagentparser.DetectorsHub().load_snapshot(self.path))
+        finally:
+            gc.unfreeze()
+
+
+class TestDispatch(unittest.TestCase):
+    clients = ['curl/7.68.0', 'python-requests/2.31.0 CPython/3.11 Linux/6.1', 'axios/1.6.0', 'Java/17.0.2',
+               'Netflix/6.0 DEVTYPE=LGTV;', 'iCanvas/5.4', 'Roku/DVP-9.10 (519.10E04111A)', 'Python-urllib/3.11',
+               'curl/8.0 (Windows NT 10.0) Chrome/100.0', '']
+
+    def results(self, hub, agents):
+        out = []
+        for agent in agents:
+            for engine in httpagentparser.ENGINES:
+                result = dict(platform=dict(name=None, version=None))
+                matched = []
+                hub.run(agent, result, engine, matched)
+                out.append((result, matched))
+        return out
+
+    def test_same_results(self):
+        hub = httpagentparser.DetectorsHub()
+        agents = self.clients + [agent for agent, _, _ in data]
+        dispatched = self.results(hub, agents)
+        for hub.dispatch, hub.prefilter in ((False, True), (True, False), (False, False)):
+            self.assertEqual(dispatched, self.results(hub, agents))
+
+    def test_token_conditions(self):
+        class Odd(httpagentparser.Browser):
+            look_for = ['Odd', '', 'Never']
+            skip_if_found = ['Even']
+
+        class Custom(httpagentparser.Browser):
+            look_for = 'Custom'
+
+            def checkWords(self, agent):
+                return 'Odd' if 'Odd' in agent else None
+
+        hub = httpagentparser.DetectorsHub()
+        hub.register(Odd())
+        hub.register(Custom())
+        for agent in ('Odd/1 ', 'Never/1 ', 'Odd/1 Even', 'Custom/1 '):
+            names = [d.name for d in hub.candidates(agent)]
+            self.assertIn('Custom', names)  # own checkWords: always run
+            self.assertEqual('Odd' in names, agent == 'Odd/1 ', agent)
+
+    def test_dispatched(self):
+        hub = httpagentparser.DetectorsHub()
+        hub.prefilter = False
+        self.assertEqual([d.name for d in hub.candidates('curl/7.68.0')], ['Curl'])
+        self.assertEqual(hub.candidates('Python-urllib/3.11'), [])
+        # a token of another detector further on falls back to the full list
+        self.assertEqual(hub.candidates('curl/8.0 (Windows NT 10.0)'), hub.detectors())
+        self.assertEqual(hub.candidates(data[0][0]), hub.detectors())
+
+    def test_entries_built_on_use(self):
+        lazy, eager = httpagentparser.DetectorsHub(), httpagentparser.DetectorsHub()
+        self.assertEqual([d.name for d in lazy.candidates('curl/7.68.0')], ['Curl'])
+        built = [key for key, entry in lazy._dispatch.items() if entry is not httpagentparser._UNBUILT]
+        self.assertEqual(built, ['curl'])
+        table = eager.dispatch_table()
+        self.assertNotIn(httpagentparser._UNBUILT, table.values())
+        def ids(detectors):
+            return [d.detector_id for d in detectors]
+
+        for agent in self.clients + [agent for agent, _, _ in data]:
+            self.assertEqual(ids(lazy.candidates(agent)), ids(eager.candidates(agent)), agent)
+        self.assertEqual(dict((k, (ids(e.detectors), e.words)) for k, e in lazy.dispatch_table().items()),
+                         dict((k, (ids(e.detectors), e.words)) for k, e in table.items()))
+
+    def test_dispatched_without_scan(self):
+        hub = httpagentparser.DetectorsHub()
+        index = hub.token_index()
+        index.scan = None  # a dispatched agent never reaches the token scan
+        self.assertEqual([d.name for d in hub.candidates('curl/7.68.0')], ['Curl'])
+        self.assertRaises(TypeError, hub.candidates, 'curl/8.0 (Windows NT 10.0)')
+
+    def test_prefiltered(self):
+        hub = httpagentparser.DetectorsHub()
+        self.assertEqual([d.name for d in hub.candidates('curl/8.0 (Windows NT 10.0)')], ['Windows', 'Curl'])
+        names = [d.name for d in hub.candidates(data[0][0])]
+        self.assertIn('ChromiumEdge', names)
+        self.assertNotIn('Safari', names)  # skipped for "Chrome"
+        self.assertNotIn('Firefox', names)
+
+    def test_registered_clients_indexed(self):
+        class JakartaHTTPClient(httpagentparser.Browser):
+            name = 'Jakarta Commons-HttpClient'
+            look_for = name
+
+        hub = httpagentparser.DetectorsHub()
+        hub.dispatch_table()
+        hub.register(JakartaHTTPClient())
+        self.assertIn('Jakarta', hub.dispatch_table())
+        agent = 'Jakarta Commons-HttpClient/3.1'
+        self.assertEqual([d.name for d in hub.candidates(agent)], ['Jakarta Commons-HttpClient'])
+        result = {}
+        hub.run(agent, result)
+        self.assertEqual(result['browser']['name'], 'Jakarta Commons-HttpClient')
+
+
+class TestNegativeCache(unittest.TestCase):
+    junk = 'zz9 plural z alpha \x00\x01 ' * 20
+
+    def test_skips_repeats(self):
+        hub = httpagentparser.DetectorsHub()
+        negative = hub.enable_negative_cache(capacity=100, error=0.001)
+        for _ in range(3):
+            result = {}
+            hub.run(self.junk, result)
+            self.assertEqual(result, {})
+        self.assertEqual((len(negative), negative.hits), (1, 2))
+        for agent, _, expected in data[:5]:
+            result = dict(platform=dict(name=None, version=None))
+            hub.run(agent, result)
+            self.assertEqual(result, detect(agent))
+        self.assertEqual(len(negative), 1)
+        self.assertRaises(ValueError, hub.run, self.junk, {}, 'fast')
+
+    def test_register_resets(self):
+        class Plural(httpagentparser.Browser):
+            look_for = 'plural'
+
+        hub = httpagentparser.DetectorsHub()
+        hub.enable_negative_cache()
+        hub.run(self.junk, {})
+        hub.register(Plural())
+        result = {}
+        hub.run(self.junk, result)
+        self.assertEqual(result['browser']['name'], 'Plural')
+
+
+class TestExactTable(unittest.TestCase):
+    def setUp(self):
+        import tempfile
+        self.tmpdir = tempfile.mkdtemp()
+        self.path = self.tmpdir + '/exact.json'
+        self.agents = [agent for agent, _, _ in data]
+
+    def tearDown(self):
+        import shutil
+        shutil.rmtree(self.tmpdir)
+        httpagentparser.detectorshub.exact_table = None
+
+    def test_most_common(self):
+        hub = httpagentparser.detectorshub
+        agents = sorted(set(self.agents))
+        table = hub.build_exact_table(agents[:3] * 3 + agents[3:5] * 2 + agents[5:], size=4)
+        self.assertEqual(len(table), 4)
+        self.assertTrue(set(agents[:3]) < set(table) < set(agents[:5]))
+        for agent, result in table.items():
+            self.assertEqual(result, detect(agent))
+
+    def test_roundtrip(self):
+        hub = httpagentparser.detectorshub
+        expected = [detect(agent) for agent in self.agents]
+        filled = detect(self.agents[0], fill_none=True)
+        hub.save_exact_table(self.path, self.agents)
+        self.assertTrue(hub.load_exact_table(self.path))
+        self.assertEqual(len(hub.exact_table), len(set(self.agents)))
+        self.assertEqual([detect(agent) for agent in self.agents], expected)
+        result = detect(self.agents[0])
+        result['os'] = 'changed'
+        self.assertEqual(detect(self.agents[0]), expected[0])
+        self.assertIs(detect(self.agents[0], frozen=True), hub.exact_table[self.agents[0]])
+        self.assertEqual(detect(self.agents[0], fill_none=True), filled)
+
+    def test_answers_first(self):
+        import json
+        hub = httpagentparser.detectorshub
+        hub.save_exact_table(self.path, self.agents[:1])
+        with open(self.path) as f:
+            table = json.load(f)
+        table['results'][self.agents[0]] = {'bot': True}
+        with open(self.path, 'w') as f:
+            json.dump(table, f)
+        self.assertTrue(hub.load_exact_table(self.path))
+        self.assertEqual(detect(self.agents[0]), {'bot': True})
+        self.assertNotEqual(detect(self.agents[0], record_detectors=True), {'bot': True})
+
+    def test_versioned(self):
+        import json
+        hub = httpagentparser.detectorshub
+        hub.save_exact_table(self.path, self.agents)
+        with open(self.path) as f:
+            table = json.load(f)
+        table['fingerprint'] = 'other'
+        with open(self.path, 'w') as f:
+            json.dump(table, f)
+        self.assertFalse(hub.load_exact_table(self.path))
+        self.assertFalse(hub.load_exact_table(self.tmpdir + '/missing.json'))
+        self.assertEqual(hub.exact_table, None)
+
+
+class TestTokenProfile(unittest.TestCase):
+    def agents(self):
+        with open('useragent.txt') as f:
+            return [agent for agent, _, _ in data] + [line.strip() for line in f if line.strip()]
+
+    def run_all(self, hub, agents):
+        results = []
+        for agent in agents:
+            result = dict(platform=dict(name=None, version=None))
+            hub.run(agent, result)
+            results.append(result)
+        return results
+
+    def test_same_results(self):
+        hub = httpagentparser.DetectorsHub()
+        hub.prefilter = hub.dispatch = False
+        agents = self.agents()
+        expected = self.run_all(hub, agents)
+        profile = hub.profile_tokens(agents)
+        self.assertEqual(profile.samples, len(agents))
+        self.assertGreater(profile.rate('Chrome'), profile.rate('OmniWeb'))
+        hub.apply_token_profile(profile)
+        safari = [d for d in hub.detectors() if d.detector_id == 'browser.Safari'][0]
+        self.assertEqual(safari._skip_order[0], 'Chrome')
+        self.assertEqual(sorted(safari._skip_order), sorted(safari.skip_if_found))
+        self.assertEqual(self.run_all(hub, agents), expected)
+        hub.apply_token_profile(None)
+        self.assertEqual(safari._skip_order, None)
+
+    def test_dispatch_order(self):
+        from httpagentparser import TokenProfile
+
+        class Probed(str):
+            def __contains__(self, word):
+                probes.append(word)
+                return str.__contains__(self, word)
+
+        hub = httpagentparser.DetectorsHub()
+        self.assertTrue(hub.prefilter and hub.dispatch)
+        agent = Probed('curl/7.68.0')
+        probes = []
+        hub.run(agent, dict(platform=dict(name=None, version=None)))
+        words = hub.dispatch_table()['curl'].words
+        self.assertEqual(probes[:len(words)], list(words))
+        self.assertNotEqual(words[:2], ('Windows', 'Linux'))
+        hub.apply_token_profile(TokenProfile(dict(Windows=9, Linux=5, Chrome=1), 10))
+        probes = []
+        result = dict(platform=dict(name=None, version=None))
+        hub.run(agent, result)
+        self.assertEqual(probes[:3], ['Windows', 'Linux', 'Chrome'])
+        self.assertEqual(sorted(probes[:len(words)]), sorted(words))
+        self.assertEqual(result, detect('curl/7.68.0'))
+        hub.apply_token_profile(None)
+        self.assertEqual(hub.dispatch_table()['curl'].words, words)
+
+    def test_sampled(self):
+        hub = httpagentparser.DetectorsHub()
+        profile = hub.enable_token_profiling(every=2, samples=10)
+        agents = self.agents()[:30]
+        expected = [detect(agent) for agent in agents]
+        self.assertEqual(self.run_all(hub, agents), expected)
+        self.assertEqual((profile.samples, hub.token_sampler), (10, None))
+        self.assertTrue(any(d._skip_order for d in hub.detectors()))
+        self.assertRaises(ValueError, hub.enable_token_profiling, every=0)
+
+    def test_save_load(self):
+        import os
+        import tempfile
+        from httpagentparser import TokenProfile
+        profile = httpagentparser.detectorshub.profile_tokens(self.agents())
+        fd, path = tempfile.mkstemp()
+        os.close(fd)
+        try:
+            profile.save(path)
+            loaded = TokenProfile.load(path)
+        finally:
+            os.remove(path)
+        self.assertEqual((loaded.hits, loaded.samples), (profile.hits, profile.samples))
+        hub = httpagentparser.DetectorsHub()
+        hub.apply_token_profile(loaded)
+        self.assertEqual(hub.token_sampler, None)
+        self.assertEqual(self.run_all(hub, self.agents()[:20]), [detect(agent) for agent in self.agents()[:20]])
+
+
+class TestShadow(unittest.TestCase):
+    def agents(self):
+        with open('useragent.txt') as f:
+            return [agent for agent, _, _ in data] + [line.strip() for line in f if line.strip()]
+
+    def test_engines_agree(self):
+        from httpagentparser.shadow import Shadow, reference_detect
+        agents = self.agents()
+        shadow = Shadow('two_phase', rate=1)
+        self.assertEqual([shadow.detect(agent) for agent in agents], [reference_detect(agent) for agent in agents])
+        report = shadow.report()
+        self.assertEqual((report['calls'], report['sampled'], report['mismatches']), (len(agents), len(agents), 0))
+        self.assertGreater(report['speedup'], 0)
+        self.assertRaises(ValueError, Shadow, 'fast')
+
+    def test_reference_bounded(self):
+        from httpagentparser.shadow import reference_detect
+        long_agent = data[0][0] + ' ' + 'x' * 5000 + ' Googlebot/2.1'
+        self.assertGreater(len(long_agent), httpagentparser.MAX_AGENT_LENGTH)
+        for agent in (long_agent, long_agent.encode('utf-8'), None):
+            self.assertEqual(reference_detect(agent), detect(agent))
+        self.assertEqual(reference_detect(long_agent, overflow='reject'), detect(long_agent, overflow='reject'))
+        self.assertFalse(reference_detect(long_agent).get('bot'))  # Googlebot lies past the cut
+
+    def test_mismatches(self):
+        from httpagentparser.shadow import Shadow
+
+        def broken(agent):
+            if 'Firefox' in agent:
+                raise RuntimeError('boom')
+            return {}
+
+        agents = self.agents()
+        shadow = Shadow(broken, rate=0.5, max_mismatches=3)
+        self.assertEqual([shadow.detect(agent) for agent in agents], [detect(agent) for agent in agents])
+        report = shadow.report()
+        self.assertTrue(0 < report['sampled'] < len(agents))
+        self.assertEqual(report['mismatches'], report['sampled'])
+        self.assertEqual(len(report['examples']), 3)
+        example = report['examples'][0]
+        self.assertEqual(example['expected'], detect(example['agent']))
+
+    def test_replay(self):
+        import json
+        import os
+        import tempfile
+        from httpagentparser.shadow import replay
+        fd, path = tempfile.mkstemp()
+        os.close(fd)
+        try:
+            summary = replay('useragent.txt', lambda agent: detect(agent, fill_none=True), report=path)
+            with open(path) as f:
+                self.assertEqual(json.load(f), summary)
+        finally:
+            os.remove(path)
+        self.assertGreater(summary['mismatches'], 0)
+        self.assertEqual(summary['mismatches'], len(summary['examples']))
+
+
+class TestCorpus(unittest.TestCase):
+    def test_seeded(self):
+        import corpus
+        first = list(corpus.generate(2000, distinct=300, seed=3))
+        self.assertEqual(list(corpus.generate(2000, distinct=300, seed=3)), first)
+        self.assertNotEqual(list(corpus.generate(2000, distinct=300, seed=4)), first)
+
+    def test_distribution(self):
+        from collections import Counter
+        import corpus
+        pool = corpus.distinct_agents(500)
+        self.assertEqual(len(set(pool)), 500)
+        counts = Counter(corpus.generate(20000, distinct=500, zipf=1.2, junk=0.05))
+        top = [count for _, count in counts.most_common(2)]
+        self.assertGreater(top[0], 1.5 * top[1])
+        junk = sum(count for agent, count in counts.items() if agent not in pool)
+        self.assertTrue(500 < junk < 1500)
+        self.assertTrue(any(detect(agent).get('bot') for agent in pool))
+
+
+class TestTwoPhase(unittest.TestCase):
+    def test_same_results(self):
+        agents = [agent for agent, _, _ in data] + ['', 'Linux; Android', 'Mozilla/5.0 (iPad; CPU OS 7_1 like Mac OS X)']
+        for agent in agents:
+            self.assertEqual(detect(agent, engine='two_phase', record_detectors=True),
+                             detect(agent, engine='reference', record_detectors=True))
+
+    def test_fewer_extractions(self):
+        calls = []
+
+        class Counting(httpagentparser.Browser):
+            look_for = 'Counting'
+
+            def getVersion(self, agent, word):
+                calls.append(agent)
+
+        class Later(httpagentparser.Browser):
+            look_for = 'Later'
+
+        hub = httpagentparser.DetectorsHub()
+        hub.register(Counting())
+        hub.register(Later())
+        result = dict(platform=dict(name=None, version=None))
+        hub.run('Counting Later/1.0 (x)', result, engine='two_phase')
+        self.assertEqual(result['browser'], {'name': 'Later', 'version': '1.0'})
+        self.assertEqual(calls, [])
+
+    def test_unknown_engine(self):
+        self.assertRaises(ValueError, detect, data[0][0], engine='fast')
+
+
+class TestMatchPosition(unittest.TestCase):
+    def test_match_offset(self):
+        chrome = httpagentparser.Chrome()
+        agent = 'Mozilla/5.0 (X11; Linux x86_64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/124.0.1 Safari/537.36'
+        word, pos = chrome.match(agent)
+        self.assertEqual(agent[pos:pos + len(word)], word)
+        self.assertEqual(chrome.versionAt(agent, word, pos), chrome.getVersion(agent, word))
+        self.assertEqual(chrome.match('Mozilla/5.0 Chrome/1 OPR/2'), None)
+
+    def test_legacy_overrides(self):
+        class OldStyle(httpagentparser.Browser):
+            look_for = 'Old'
+
+            def checkWords(self, agent):
+                return 'Style' if 'Style' in agent else None
+
+            def getVersion(self, agent, word):
+                return 'v-' + agent.split(word)[-1].strip()
+
+        detector = OldStyle()
+        self.assertEqual(detector.match('Old Style 3'), ('Style', 4))
+        self.assertEqual(detector.match('Old 3'), None)
+        hub = httpagentparser.DetectorsHub()
+        hub.register(detector)
+        for engine in httpagentparser.ENGINES:
+            result = {}
+            hub.run('Old Style 3', result, engine=engine)
+            self.assertEqual(result['browser'], {'name': 'OldStyle', 'version': 'v-3'})
+
+    def test_empty_token_never_matches(self):
+        class Empty(httpagentparser.Browser):
+            look_for = ['', 'Empty']
+
+        self.assertEqual(Empty().match('Empty/1.0 '), None)
+
+
+class TestClientHints(unittest.TestCase):
+    ua = 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/124.0.0.0 Safari/537.36'
+
+    def test_parse_list(self):
+        from httpagentparser.clienthints import parse_list
+        self.assertEqual(parse_list('"Chromium";v="124", "Not-A.Brand";v="99", "Google Chrome";v="124"'),
+                         [('Chromium', {'v': '124'}), ('Not-A.Brand', {'v': '99'}), ('Google Chrome', {'v': '124'})])
+        self.assertEqual(parse_list('"a\\"b";x;v=1'), [('a"b', {'x': True, 'v': '1'})])
+
+    def test_hints_only(self):
+        result = httpagentparser.detect_headers({
+            'Sec-CH-UA': '"Chromium";v="124", "Microsoft Edge";v="124", "Not-A.Brand";v="99"',
+            'Sec-CH-UA-Full-Version-List': '"Chromium";v="124.0.6367.61", "Microsoft Edge";v="124.0.2478.51"',
+            'Sec-CH-UA-Platform': '"Windows"',
+            'Sec-CH-UA-Platform-Version': '"15.0.0"',
+            'Sec-CH-UA-Mobile': '?0',
+        })
+        self.assertEqual(result, {'bot': False, 'browser': {'name': 'ChromiumEdge', 'version': '124.0.2478.51'},
+                                  'os': {'name': 'Windows', 'version': '11'},
+                                  'platform': {'name': 'Windows', 'version': '11'}})
+
+    def test_android_model_and_environ(self):
+        result = httpagentparser.detect_headers({
+            'HTTP_SEC_CH_UA': '"Google Chrome";v="124", "Chromium";v="124"',
+            'HTTP_SEC_CH_UA_PLATFORM': '"Android"',
+            'HTTP_SEC_CH_UA_PLATFORM_VERSION': '"14.0.0"',
+            'HTTP_SEC_CH_UA_MODEL': '"Pixel 8"',
+        })
+        self.assertEqual(result['dist'], {'name': 'Android', 'version': '14.0.0'})
+        self.assertEqual(result['os'], {'name': 'Linux'})
+        self.assertEqual(result['browser'], {'name': 'Chrome', 'version': '124'})
+        self.assertEqual(result['model'], 'Pixel 8')
+
+    def test_fallback(self):
+        self.assertEqual(httpagentparser.detect_headers({'User-Agent': self.ua}), detect(self.ua))
+        result = httpagentparser.detect_headers({'User-Agent': self.ua, 'Sec-CH-UA-Platform': '"macOS"',
+                                                 'Sec-CH-UA-Platform-Version': '"14.4.1"'})
+        self.assertEqual(result['browser'], detect(self.ua)['browser'])
+        self.assertEqual(result['flavor'], {'name': 'MacOS', 'version': '14.4.1'})
+        self.assertEqual(result['os'], {'name': 'Macintosh'})
+        self.assertEqual(result['platform'], {'name': 'Mac OS', 'version': '14.4.1'})
+
+
 if __name__ == '__main__':
     unittest.main()